@@ -1,11 +1,15 @@
 @reboot cd hitch && screen -d -m bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/waitress-serve server:app; bash'
-# every minute
-* * * * * cd hitch && /usr/bin/flock -n /tmp/show.lockfile bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate show' > cronlog.txt 2>&1
+# keeps running and updates the map a few seconds after new reviews come in
+@reboot cd hitch && screen -d -m bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate-daemon show --args incremental --lockfile /tmp/show.lockfile > cronlog.txt 2>&1'
+# builds the country index of new reviews if it is missing, e.g. on a fresh deployment
+@reboot cd hitch && bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate countries --args missing-only' > countries.txt 2>&1
 # every 10 minutes
-*/10 * * * * cd hitch && /usr/bin/flock -n /tmp/show.lockfile bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate show --args light' > cronlog-light.txt 2>&1
+*/10 * * * * cd hitch && /usr/bin/flock -n /tmp/show.lockfile bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate show' > cronlog-light.txt 2>&1
 # each day at midnight
 0 0 * * * cd hitch && /usr/bin/flock -n /tmp/dump.lockfile bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate dump' > dumplog.txt 2>&1
 # every day at midnight
 0 0 * * * cd hitch && /usr/bin/flock -n /tmp/dashboard.lockfile bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate dashboard' > dashboard.txt 2>&1
+# every day at midnight, reviews are added to the stats as they come in, this picks up bans and edits
+0 0 * * * cd hitch && /usr/bin/flock -n /tmp/user_stats.lockfile bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate user_stats' > user_stats.txt 2>&1
 # every month
 0 0 1 * * cd hitch && /usr/bin/flock -n /tmp/hitchhiking.lockfile bash -c '. $HOME/.bashrc; /home/bob/.asdf/shims/python flask --app hitch generate hitchhiking' > hitchhiking.txt 2>&1
@@ -1,6 +1,6 @@
-import importlib
+import contextlib
+import logging
 import os
-import sys
 
 import click
 from flask import Flask, render_template, send_from_directory
@@ -8,7 +8,9 @@ from flask_security import SQLAlchemyUserDatastore
 
 from hitch.blueprints.main import main_bp
 from hitch.blueprints.user import user_bp
-from hitch.extensions import db, mail, security
+from hitch.dist import send_dist_file
+from hitch.extensions import db, mail, security, writer
+from hitch.helpers import close_db, get_db
 from hitch.models import Role, User
 from hitch.settings import config
 
@@ -33,6 +35,8 @@ def create_app(config_name=None):
 def register_extensions(app):
     db.init_app(app)
     mail.init_app(app)
+    writer.init_app(app)
+    app.teardown_appcontext(close_db)
 
     user_datastore = SQLAlchemyUserDatastore(db, User, Role)
     security.init_app(app, user_datastore)
@@ -50,6 +54,7 @@ def register_commands(app):
         """Initialize the database."""
         # create necessary sql tables
         security.datastore.db.create_all()
+        writer.create_tables()
 
         # define roles - not really needed
         security.datastore.find_or_create_role(
@@ -65,45 +70,142 @@ def register_commands(app):
 
     @app.cli.command()
     @click.argument("script", default="show")
-    @click.option("--args", default="", help="Arguments for the script")
+    @click.option("--args", default="", help="Arguments for the script, e.g. incremental or var=wait divider=")
     def generate(script, args):
         """
         Executes a given script
 
         USAGE: flask --app hitch generate <script> --args <args>
-        EXAMPLE: flask --app hitch generate show --args light
+        EXAMPLE: flask --app hitch generate show --args incremental
         """
-        try:
-            module = f"hitch.scripts.{script}"
+        from hitch.jobs import Snapshot, parse_args, run_job
 
-            # Sets arguments on the current process (workaround because import_module cannot take args)
-            sys.argv.clear()
-            sys.argv.append(args)
-
-            # Runs a script automatically through importing it (or reloading so it gets executed again)
-            if module not in sys.modules:
-                importlib.import_module(module)
-            else:
-                importlib.reload(sys.modules[module])
-        except Exception as e:
-            print(e)
+        # Failures are raised, so cron and CI see them in the exit code and the log has the traceback
+        run_job(script, Snapshot(get_db()), **parse_args(args))
 
     @app.cli.command("generate-all")
-    @click.pass_context
-    def generate_all(ctx):
+    @click.option("--workers", "-w", type=int, default=None, help="Jobs to run at the same time (default: number of CPUs)")
+    @click.option("--timeout", type=float, default=None, help="Seconds after which every job is stopped (default: per job)")
+    def generate_all(workers, timeout):
+        """
+        Executes all scripts defined in hitch/scheduler.py, those that do not depend on each other at the same time
+
+        EXAMPLE: flask --app hitch generate-all --workers 2
+        """
+        import time
+
+        from hitch.scheduler import JOBS, format_summary, run
+
+        start = time.monotonic()
+        workers = workers or os.cpu_count() or 1
+        results = run(JOBS, workers, timeout)
+        print(format_summary(results, time.monotonic() - start, workers))
+
+        failed = [result["script"] for result in results if result["status"] != "ok"]
+        if failed:
+            raise click.ClickException(f"{', '.join(failed)} did not succeed")
+
+    @app.cli.command("generate-daemon")
+    @click.argument("script", default="show")
+    @click.option("--args", default="incremental", help="Arguments for the script")
+    @click.option("--interval", default=1.0, help="Seconds between checks for changes")
+    @click.option("--debounce", default=2.0, help="Seconds without changes to wait for before generating")
+    @click.option("--max-delay", default=10.0, help="Maximum seconds between a change and generating")
+    @click.option("--lockfile", default=None, help="File to lock while generating, e.g. /tmp/show.lockfile")
+    def generate_daemon(script, args, interval, debounce, max_delay, lockfile):
+        """
+        Keeps running and executes a script whenever the database changes
+
+        EXAMPLE: flask --app hitch generate-daemon show --args incremental --lockfile /tmp/show.lockfile
+        """
+        from hitch.jobs import parse_args, run_daemon
+
+        logging.basicConfig(level=logging.INFO)
+        with contextlib.suppress(KeyboardInterrupt):
+            run_daemon(get_db(), script, parse_args(args), interval, debounce, max_delay, lockfile)
+
+    @app.cli.command("startup-profile")
+    @click.option("--script", default=None, help="Also import a generator script, e.g. show")
+    @click.option("--top", default=20, help="Number of slowest imports to list")
+    @click.option("--strict", is_flag=True, help="Fail if heavy libraries are loaded, e.g. in CI")
+    def startup_profile(script, top, strict):
+        """
+        Reports how long it takes to start the app in a fresh interpreter and which imports are slow
+
+        EXAMPLE: flask --app hitch startup-profile --strict
+        """
+        from hitch.startup import APP_CODE, HEAVY_MODULES, format_profile, profile_imports
+
+        code = APP_CODE + (f"; import hitch.scripts.{script}" if script else "")
+        seconds, modules = profile_imports(code)
+        print(format_profile(seconds, modules, top))
+
+        if strict and any(name in HEAVY_MODULES for name, _, _ in modules):
+            raise click.ClickException("Heavy libraries are loaded on startup")
+
+    @app.cli.command()
+    @click.option("--rows", "-r", type=int, multiple=True, help="Number of reviews, can be repeated (default: 10k to 10M)")
+    @click.option("--stage", "-s", multiple=True, help="Script to run, e.g. show or show:incremental, can be repeated")
+    @click.option("--seed", default=0, help="Seed of the synthetic data")
+    @click.option("--data-dir", default=None, help="Directory to keep the synthetic databases in between runs")
+    @click.option("--output", "-o", default=None, help="Results file (default: db/benchmarks/benchmark-<time>-<commit>.json)")
+    @click.option("--baseline", "-b", default=None, help="Results file of an earlier run to compare with")
+    def benchmark(rows, stage, seed, data_dir, output, baseline):
+        """
+        Runs the generator scripts against synthetic databases and records wall time, peak memory and output size
+
+        EXAMPLE: flask --app hitch benchmark -r 10000 -r 100000 -s show -s show:incremental -s dump
+        """
+        import simplejson
+
+        from hitch.benchmark.runner import SIZES, STAGES, format_results, run
+
+        logging.basicConfig(level=logging.INFO)
+        results = run(list(rows) or SIZES, list(stage) or STAGES, seed, data_dir, output)
+
+        if baseline:
+            with open(baseline, encoding="utf-8") as f:
+                baseline = simplejson.load(f)
+        print(format_results(results, baseline))
+
+    @app.cli.command("create-indexes")
+    def create_indexes():
+        """
+        Creates the indexes missing from an existing database, e.g. one restored from a dump or created by pandas
         """
-        Executes all scripts defined in array with given args
+        from hitch.writer import create_indexes
+
+        created = create_indexes(get_db())
+        print(f"Created {', '.join(created)}" if created else "All indexes exist already")
+
+    @app.cli.command("benchmark-queries")
+    @click.option("--rows", "-r", type=int, default=None, help="Use a synthetic database with this many reviews instead")
+    @click.option("--data-dir", default=None, help="Directory to keep the synthetic databases in between runs")
+    @click.option("--repeat", default=3, help="Runs of every query, the median is reported")
+    @click.option("--compare", is_flag=True, help="Also run the queries against a copy of the database without indexes")
+    def benchmark_queries(rows, data_dir, repeat, compare):
         """
-        scripts = [("show", ""), ("dump", ""), ("dashboard", ""), ("hitchhiking", "")]
-        for script, args in scripts:
-            ctx.invoke(generate, script=script, args=args)
+        Prints the query plan and timing of the queries the app and the generators run all the time
+
+        EXAMPLE: flask --app hitch benchmark-queries -r 1000000 --compare
+        """
+        import tempfile
+
+        from hitch.benchmark.queries import format_results, run
+        from hitch.benchmark.runner import get_database
+        from hitch.helpers import get_database_path
+
+        logging.basicConfig(level=logging.INFO)
+        with tempfile.TemporaryDirectory(prefix="hitch-benchmark-") as scratch:
+            database = get_database(rows, 0, data_dir or scratch) if rows else get_database_path(get_db())
+            print(format_results(run(database, repeat, compare)))
 
 
 def register_routes(app):
     # Serve dist
     @app.route("/<path:path>")
     def catch_all(path):
-        return send_from_directory(os.path.join(baseDir, "dist"), path)
+        return send_dist_file(path)
 
     @app.route("/copyright")
     @app.route("/copyright.html")
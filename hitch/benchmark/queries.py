@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import urllib.parse
+
+from hitch.duplicates import DUPLICATES_QUERY
+from hitch.filters import DEFAULT_LIMIT, build_query, parse_filters
+from hitch.jobs import POINTS_QUERY
+from hitch.scripts.show import RECENT_LIMIT, RECENT_QUERY, get_spots_query
+from hitch.writer import CREATE_INDEXES, get_index_name
+
+# Spots looked up at once by incremental runs of show
+SPOTS = 400
+
+
+def get_spots(con):
+    """Parameters for the spots of the newest reviews"""
+    coords = con.execute("select lat, lon from points order by rowid desc limit ?", (SPOTS,)).fetchall()
+    return [value for coord in coords for value in coord]
+
+
+def get_user(con):
+    """Parameters for the author of the newest review by a registered user"""
+    row = con.execute("select user_id from points where user_id is not null order by rowid desc limit 1").fetchone()
+    return [row[0] if row else 0]
+
+
+def get_user_filter(con):
+    """Parameters of /api/points for the hitchhiker of the newest review"""
+    row = con.execute(
+        "select coalesce(nickname, username) from points left join user on user.id = points.user_id"
+        " where coalesce(nickname, username) is not null order by points.rowid desc limit 1"
+    ).fetchone()
+    return {"user": row[0] if row else "", "limit": DEFAULT_LIMIT + 1}
+
+
+def get_country_filter(con):
+    """Parameters of /api/points for the country of the newest review, with a minimum rating"""
+    row = con.execute("select country from points where country is not null order by rowid desc limit 1").fetchone()
+    return {"country": row[0] if row else "", "rating_min": 4, "limit": DEFAULT_LIMIT + 1}
+
+
+# The queries the app and the generators run on every request or run, by name: (query, function returning parameters)
+QUERIES = {
+    "all points": (POINTS_QUERY.format(""), lambda con: []),
+    "new points": (
+        POINTS_QUERY.format("and rowid > ?"),
+        lambda con: [con.execute("select max(rowid) - 100 from points").fetchone()[0]],
+    ),
+    "spots": (get_spots_query(SPOTS), get_spots),
+    "recent feed": (RECENT_QUERY, lambda con: [RECENT_LIMIT]),
+    "reviews of a user": ("select rowid, rating, wait, datetime from points where user_id = ?", get_user),
+    "duplicates": (DUPLICATES_QUERY, lambda con: []),
+    "api points by user": (build_query(parse_filters({"user": "-"}))[0], get_user_filter),
+    "api points by country": (build_query(parse_filters({"country": "-", "rating_min": "4"}))[0], get_country_filter),
+    "watermark": ("select coalesce(max(rowid), 0), count(*), coalesce(sum(banned), 0) from points", lambda con: []),
+}
+
+
+def explain(con, query, params):
+    """Returns the steps of the query plan, indented by their depth"""
+    depths, lines = {0: -1}, []
+    for id_, parent, _, detail in con.execute("explain query plan " + query, params):
+        depths[id_] = depths.get(parent, -1) + 1
+        lines.append("  " * depths[id_] + detail)
+    return lines
+
+
+def is_scan(plan):
+    """Whether the plan reads a whole table (or a whole index of it)"""
+    return any(line.strip().startswith(("SCAN points", "SCAN duplicates")) for line in plan)
+
+
+def measure(con, repeat):
+    """Runs every query `repeat` times
+
+    Returns:
+        Name, plan, median seconds and number of rows of every query
+    """
+    results = []
+    for name, (query, get_params) in QUERIES.items():
+        params = get_params(con)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = len(con.execute(query, params).fetchall())
+            timings.append(time.perf_counter() - start)
+        results.append({"name": name, "plan": explain(con, query, params), "seconds": statistics.median(timings), "rows": rows})
+    return results
+
+
+def connect_readonly(database):
+    return sqlite3.connect(f"file:{urllib.parse.quote(database)}?mode=ro", uri=True)
+
+
+def copy_without_indexes(database, directory):
+    """Returns a connection to a copy of the database without the indexes of `hitch.writer.CREATE_INDEXES`"""
+    path = os.path.join(directory, "without-indexes.sqlite")
+    source = connect_readonly(database)
+    con = sqlite3.connect(path)
+    try:
+        source.backup(con)
+    finally:
+        source.close()
+    with con:
+        for statement in CREATE_INDEXES:
+            con.execute(f"drop index if exists {get_index_name(statement)}")
+    return con
+
+
+def run(database, repeat=3, compare=False):
+    """Measures the queries against the database, and against a copy without the indexes if `compare` is set
+
+    Returns:
+        The results of `measure`, with those of the copy as `without_indexes` of every query
+    """
+    con = connect_readonly(database)
+    try:
+        results = measure(con, repeat)
+    finally:
+        con.close()
+
+    if compare:
+        with tempfile.TemporaryDirectory(prefix="hitch-queries-") as directory:
+            con = copy_without_indexes(database, directory)
+            try:
+                for result, other in zip(results, measure(con, repeat), strict=True):
+                    result["without_indexes"] = other
+            finally:
+                con.close()
+    return results
+
+
+def format_results(results):
+    """Returns the plan and timing of every query, flagging those that still read a whole table"""
+    lines = []
+    for result in results:
+        line = f"{result['name']}: {result['seconds'] * 1000:.1f} ms, {result['rows']} rows"
+        if "without_indexes" in result:
+            line += f" ({result['without_indexes']['seconds'] * 1000:.1f} ms without indexes)"
+        lines.append(line + ("  [scan]" if is_scan(result["plan"]) else ""))
+        lines.extend("    " + step for step in result["plan"])
+    return "\n".join(lines)
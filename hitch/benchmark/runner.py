@@ -0,0 +1,207 @@
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import simplejson
+
+from hitch.benchmark import synthetic
+from hitch.helpers import get_dirs
+
+logger = logging.getLogger(__name__)
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Stages are scripts as passed to `flask generate`, optionally with arguments after a colon, e.g. "show:incremental"
+STAGES = ["show", "dump", "dashboard", "heatmap"]
+
+RESULTS_DIR = os.path.join(get_dirs()["db"], "benchmarks")
+
+# Bump when the layout of the results file changes
+RESULTS_VERSION = 1
+
+
+def get_commit():
+    """Returns the checked out commit and whether there are uncommitted changes, or None outside of a git checkout"""
+    root = get_dirs()["root"]
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True)
+        status = subprocess.run(["git", "status", "--porcelain", "-uno"], cwd=root, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def get_database(rows, seed, data_dir):
+    """Returns the path of a synthetic database with `rows` reviews, generating it if it is not in `data_dir` yet"""
+    path = os.path.join(data_dir, f"synthetic-{rows}-{seed}-v{synthetic.VERSION}.sqlite")
+    if not os.path.exists(path):
+        logger.info(f"Generating synthetic database with {rows} reviews")
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        # In a separate process: Linux passes the peak memory on to children, which would inflate the measurements
+        process = multiprocessing.get_context("spawn").Process(
+            target=synthetic.generate_database, args=(path + ".tmp", rows, seed)
+        )
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Generating the synthetic database failed with exit code {process.exitcode}")
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def snapshot(directory):
+    """Returns size and modification time of all files below the directory"""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            files[os.path.join(root, name)] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def run_stage(stage, env, log_path):
+    """Runs a generator script in a fresh process and measures it
+
+    Returns:
+        Wall time in seconds, peak RSS in bytes and the exit code of the process
+    """
+    script, _, args = stage.partition(":")
+    command = [sys.executable, "-m", "flask", "--app", "hitch", "generate", script, "--args", args]
+
+    with open(log_path, "wb") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT, cwd=get_dirs()["root"])
+        # wait4 gives the resource usage of this one child, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return seconds, peak_rss, process.returncode
+
+
+def run(sizes=SIZES, stages=STAGES, seed=0, data_dir=None, output=None):
+    """Runs the stages against synthetic databases of all sizes and writes the measurements as JSON
+
+    Everything runs offline: scripts write into a scratch directory instead of dist/ and db/, and countries are
+    never looked up with Nominatim. Every size starts with empty caches.
+
+    Args:
+        sizes: Numbers of reviews in the synthetic databases
+        stages: Scripts to run, in order, against every database
+        seed: Seed of the synthetic data
+        data_dir: Keeps the generated databases there to reuse them in later runs, by default they are deleted
+        output: Path of the results file, by default a new file in db/benchmarks
+
+    Returns:
+        The results as written to the file
+    """
+    commit, dirty = get_commit()
+    results = {
+        "version": RESULTS_VERSION,
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "stages": [],
+    }
+
+    scratch = tempfile.mkdtemp(prefix="hitch-benchmark-")
+    try:
+        if data_dir is None:
+            data_dir = os.path.join(scratch, "data")
+        os.makedirs(data_dir, exist_ok=True)
+
+        for rows in sizes:
+            database = get_database(rows, seed, data_dir)
+
+            workdir = os.path.join(scratch, str(rows))
+            dist_dir, db_dir = os.path.join(workdir, "dist"), os.path.join(workdir, "db")
+            os.makedirs(dist_dir)
+            os.makedirs(db_dir)
+
+            env = dict(
+                os.environ,
+                DATABASE_URI=database,
+                HITCH_DIST_DIR=dist_dir,
+                HITCH_DB_DIR=db_dir,
+                NOMINATIM_FALLBACK="false",
+            )
+
+            for stage in stages:
+                logger.info(f"Running {stage} against {rows} reviews")
+                before = snapshot(dist_dir)
+                log_path = os.path.join(workdir, f"{stage.replace(':', '-')}.log")
+                seconds, peak_rss, returncode = run_stage(stage, env, log_path)
+                written = [size for path, (mtime, size) in snapshot(dist_dir).items() if before.get(path) != (mtime, size)]
+
+                # The script records its own stages into the metrics file of the scratch db directory
+                metrics_path = os.path.join(db_dir, "metrics.jsonl")
+                steps = []
+                if os.path.exists(metrics_path):
+                    with open(metrics_path, encoding="utf-8") as f:
+                        steps = simplejson.loads(f.readlines()[-1])["stages"]
+                    os.remove(metrics_path)
+
+                if returncode != 0:
+                    with open(log_path, encoding="utf-8", errors="replace") as log:
+                        logger.error(f"{stage} failed with exit code {returncode}:\n{log.read()[-2000:]}")
+
+                results["stages"].append(
+                    {
+                        "rows": rows,
+                        "stage": stage,
+                        "seconds": round(seconds, 3),
+                        "peak_rss_bytes": peak_rss,
+                        "output_bytes": sum(written),
+                        "output_files": len(written),
+                        "database_bytes": os.path.getsize(database),
+                        "returncode": returncode,
+                        "steps": steps,
+                    }
+                )
+
+            shutil.rmtree(workdir)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"benchmark-{stamp}-{(commit or 'unknown')[:10]}.json")
+
+    with open(output + ".tmp", "w", encoding="utf-8") as f:
+        simplejson.dump(results, f, indent=2)
+    os.replace(output + ".tmp", output)
+    logger.info(f"Results written to {output}")
+
+    return results
+
+
+def format_results(results, baseline=None):
+    """Returns a table of the results, with the change relative to the baseline results if given"""
+    previous = {(s["rows"], s["stage"]): s for s in baseline["stages"]} if baseline else {}
+
+    lines = [f"{'rows':>10}  {'stage':<20}{'seconds':>10}{'peak MB':>10}{'output MB':>11}  status"]
+    for s in results["stages"]:
+        line = (
+            f"{s['rows']:>10}  {s['stage']:<20}{s['seconds']:>10.2f}{s['peak_rss_bytes'] / 2**20:>10.0f}"
+            + f"{s['output_bytes'] / 2**20:>11.1f}  {'ok' if s['returncode'] == 0 else 'failed'}"
+        )
+        old = previous.get((s["rows"], s["stage"]))
+        if old and old["seconds"] > 0 and old["peak_rss_bytes"] > 0:
+            line += f"  time x{s['seconds'] / old['seconds']:.2f}, memory x{s['peak_rss_bytes'] / old['peak_rss_bytes']:.2f}"
+        lines.append(line)
+    return "\n".join(lines)
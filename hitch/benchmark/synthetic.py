@@ -0,0 +1,201 @@
+import logging
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from hitch.writer import CREATE_DUPLICATES, CREATE_POINTS, POINT_COLUMNS, create_indexes
+
+logger = logging.getLogger(__name__)
+
+# Bump when the generated data changes, so databases kept from earlier runs are generated again
+VERSION = 4
+
+# Rows are generated and written in chunks of this size to keep memory flat for the large sizes
+CHUNK_SIZE = 500_000
+
+# Only the columns the generators read, the real table is created by Flask-Security
+CREATE_USERS = """
+create table if not exists user (
+    id INTEGER PRIMARY KEY,
+    username TEXT UNIQUE,
+    email TEXT,
+    active BOOLEAN
+)
+"""
+
+# Hitchhiking happens around cities, spots are scattered around these centers
+CITIES = np.array(
+    [
+        (52.52, 13.40, "DE"),
+        (48.86, 2.35, "FR"),
+        (52.23, 21.01, "PL"),
+        (50.08, 14.44, "CZ"),
+        (40.42, -3.70, "ES"),
+        (45.46, 9.19, "IT"),
+        (59.33, 18.07, "SE"),
+        (41.01, 28.98, "TR"),
+        (44.43, 26.10, "RO"),
+        (55.76, 37.62, "RU"),
+        (41.72, 44.79, "GE"),
+        (-34.60, -58.38, "AR"),
+        (19.43, -99.13, "MX"),
+        (45.50, -73.57, "CA"),
+        (-33.87, 151.21, "AU"),
+        (-1.29, 36.82, "KE"),
+        (35.68, 139.69, "JP"),
+        (43.24, 76.89, "KZ"),
+    ],
+    dtype=object,
+)
+
+SIGNALS = np.array(["thumb", "sign", "ask", "ask-sign", None], dtype=object)
+SIGNAL_WEIGHTS = [0.3, 0.15, 0.05, 0.05, 0.45]
+
+WORDS = np.array(
+    "good spot wait long short car truck driver police gas station exit ramp highway city center bus walk sign "
+    "<b>nice</b> & people friendly rain night lift border shoulder parking lot".split(),
+    dtype=object,
+)
+
+
+def generate_places(rng, num_places):
+    """Returns coordinates and country codes of the spots reviews are given for
+
+    The last few spots are twins of other spots a few hundred meters away, these are reported as duplicates.
+    """
+    city = rng.integers(0, len(CITIES), num_places)
+    lat = CITIES[city, 0].astype(np.float64) + rng.normal(0, 1.5, num_places)
+    lon = CITIES[city, 1].astype(np.float64) + rng.normal(0, 2.5, num_places)
+
+    twins = np.arange(num_places - num_places // 50, num_places)
+    originals = rng.integers(0, max(num_places - len(twins), 1), len(twins))
+    lat[twins] = lat[originals] + rng.normal(0, 0.003, len(twins))
+    lon[twins] = lon[originals] + rng.normal(0, 0.003, len(twins))
+    city[twins] = city[originals]
+
+    lat, lon = np.round(lat.clip(-85, 85), 6), np.round((lon + 180) % 360 - 180, 6)
+    return lat, lon, CITIES[city, 2], np.column_stack([twins, originals])
+
+
+def generate_comments(rng, n):
+    """Returns comments of varying length, a third of the reviews have none"""
+    lengths = rng.geometric(1 / 25, n)
+    words = WORDS[rng.integers(0, len(WORDS), lengths.sum())]
+    comments = np.array([" ".join(c) for c in np.split(words, np.cumsum(lengths)[:-1])], dtype=object)
+    comments[rng.random(n) < 0.1] += "\nEdit: still works"
+    comments[rng.random(n) < 0.33] = None
+    return comments
+
+
+def generate_points(rng, start, n, places, num_users, num_rows):
+    """Returns a chunk of `n` reviews, reviews are appended in the order they were written like in production"""
+    place_lat, place_lon, place_country, _ = places
+
+    # Most spots have a few reviews, a handful of popular ones have many
+    place = rng.integers(0, len(place_lat), n)
+    popular = rng.random(n) < 0.3
+    place[popular] = (rng.zipf(1.3, popular.sum()) * 7919) % len(place_lat)
+    lat, lon = place_lat[place], place_lon[place]
+
+    has_dest = rng.random(n) < 0.6
+    dest_lat = np.where(has_dest, (lat + rng.normal(0, 1.5, n)).clip(-85, 85), np.nan)
+    dest_lon = np.where(has_dest, lon + rng.normal(0, 2, n), np.nan)
+
+    # Spread over 2006 until now, in insertion order; the oldest reviews have no date
+    position = (start + np.arange(n)) / num_rows
+    seconds = (position * 19 * 365 * 86400).astype(np.int64) + rng.integers(0, 3600, n)
+    dt = pd.Timestamp("2006-01-01") + pd.to_timedelta(seconds * 10**6 + rng.integers(0, 10**6, n), unit="us")
+    dt = dt.astype(str).to_numpy(dtype=object)
+    dt[position < 0.05] = None
+
+    ride_dt = (pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 5 * 365, n), unit="D")).strftime("%Y-%m-%d")
+    ride_dt = ride_dt.to_numpy(dtype=object)
+    ride_dt[rng.random(n) < 0.7] = None
+
+    # Reviews of registered users have no nickname, some old reviews have neither
+    registered = rng.random(n) < 0.3
+    user_id = pd.array(rng.integers(1, num_users + 1, n), dtype="Int64")
+    user_id[~registered] = pd.NA
+
+    nickname = np.array([f"Hiker{i}" for i in rng.zipf(1.5, n) % max(num_users * 2, 1)], dtype=object)
+    nickname[registered] = None
+    nickname[rng.random(n) < 0.2] = None
+
+    return pd.DataFrame(
+        {
+            "id": rng.integers(0, 2**63 - 1, n, dtype=np.int64),
+            "rating": rng.choice([1.0, 2.0, 3.0, 4.0, 5.0], n, p=[0.08, 0.1, 0.2, 0.3, 0.32]),
+            "wait": np.where(rng.random(n) < 0.7, np.round(rng.lognormal(2.8, 1, n)).clip(0, 600), np.nan),
+            "comment": generate_comments(rng, n),
+            "nickname": nickname,
+            "datetime": dt,
+            "ip": "127.0.0.1",
+            "reviewed": 0,
+            "banned": (rng.random(n) < 0.02).astype(int),
+            "lat": lat,
+            "dest_lat": dest_lat,
+            "lon": lon,
+            "dest_lon": dest_lon,
+            "country": place_country[place],
+            "signal": rng.choice(SIGNALS, n, p=SIGNAL_WEIGHTS),
+            "ride_datetime": ride_dt,
+            "user_id": user_id,
+        }
+    )[POINT_COLUMNS]
+
+
+def generate_duplicates(rng, n, places):
+    """Returns `n` duplicate reports of twin spots, some reported more than once, half of them reviewed"""
+    place_lat, place_lon, _, twins = places
+    pairs = twins[rng.integers(0, len(twins), n)] if len(twins) else twins
+    twin, original = pairs.T
+    n = len(pairs)
+    reviewed = rng.random(n) < 0.5
+    return pd.DataFrame(
+        {
+            "datetime": str(pd.Timestamp("2024-07-01")),
+            "ip": "127.0.0.1",
+            "reviewed": reviewed.astype(int),
+            "accepted": (reviewed & (rng.random(n) < 0.8)).astype(int),
+            "from_lat": place_lat[twin],
+            "to_lat": place_lat[original],
+            "from_lon": place_lon[twin],
+            "to_lon": place_lon[original],
+        }
+    )
+
+
+def generate_database(path, rows, seed=0):
+    """Writes a database with `rows` reviews and proportional numbers of spots, users and duplicate reports
+
+    Args:
+        path: Path of the SQLite database, must not exist yet
+        rows: Number of reviews
+        seed: Seed of the random generator, the same seed gives the same database
+    """
+    rng = np.random.default_rng(seed)
+    num_users = max(rows // 50, 10)
+    places = generate_places(rng, max(rows // 4, 1))
+
+    con = sqlite3.connect(path)
+    con.execute(CREATE_POINTS)
+    con.execute(CREATE_DUPLICATES)
+    con.execute(CREATE_USERS)
+
+    with con:
+        con.executemany(
+            "insert into user (id, username, email, active) values (?, ?, ?, 1)",
+            ((i, f"hiker{i}", f"hiker{i}@example.com") for i in range(1, num_users + 1)),
+        )
+
+    for start in range(0, rows, CHUNK_SIZE):
+        n = min(CHUNK_SIZE, rows - start)
+        logger.info(f"Generating reviews {start} to {start + n} of {rows}")
+        generate_points(rng, start, n, places, num_users, rows).to_sql("points", con, index=False, if_exists="append")
+
+    generate_duplicates(rng, max(rows // 100, 1), places).to_sql("duplicates", con, index=False, if_exists="append")
+    con.commit()
+    # Created after the rows are written, which is faster than updating them on every insert
+    create_indexes(con)
+    con.close()
@@ -1,32 +1,141 @@
 import math
+import os
 import random
 from datetime import datetime
 
-import pandas as pd
-import requests
 from flask import (
     Blueprint,
-    current_app,
+    Response,
+    abort,
+    jsonify,
     redirect,
     render_template,
     request,
 )
 from flask_security import current_user
 
-from hitch.helpers import get_db
+from hitch.deltas import get_delta
+from hitch.extensions import writer
+from hitch.filters import fetch_points, parse_filters
+from hitch.helpers import get_db, get_dirs
+from hitch.places import get_place, get_recent
 
 main_bp = Blueprint("main", __name__)
 
 
 # Index route for the map, supports optional .html ending
-# Additionally, there can be map variations: light, with_destination
+# Additionally, there can be map variations: light, with_destination, tiles
 @main_bp.route("/", defaults={"map_variation": None})
-@main_bp.route("/<any(light, with_destination):map_variation>")
-@main_bp.route("/<any(index, light, with_destination):map_variation>.html")
+@main_bp.route("/<any(light, with_destination, tiles):map_variation>")
+@main_bp.route("/<any(index, light, with_destination, tiles):map_variation>.html")
 def map(map_variation):
     return render_template("map.html", map_variation=map_variation)
 
 
+# Places within a bounding box (west,south,east,north), clustered on low zoom levels
+# Additionally, the same map variations as for the index route are supported
+@main_bp.route("/api/places", methods=["GET"])
+def places():
+    try:
+        west, south, east, north = (float(v) for v in request.args["bbox"].split(","))
+    except (KeyError, ValueError):
+        abort(400, "bbox must be given as west,south,east,north")
+
+    zoom = request.args.get("zoom", default=19, type=int)
+    variation = request.args.get("variation")
+    if variation not in [None, "light", "with_destination"]:
+        abort(400, "Unknown map variation")
+
+    # numpy is only loaded by the workers that serve this
+    from hitch.spatial import get_index
+
+    filename = f"points_{variation}.json" if variation else "points.json"
+    try:
+        index = get_index(os.path.join(get_dirs()["dist"], filename))
+    except FileNotFoundError:
+        abort(404)
+
+    places, clusters = index.lookup(west, south, east, north, zoom)
+
+    response = jsonify({"generation": index.generation, "places": places, "clusters": clusters})
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+
+# Reviews filtered by user, country, rating, waiting time, signal and ride date, newest first in pages
+@main_bp.route("/api/points", methods=["GET"])
+def points():
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    points, before = fetch_points(get_db(), filters)
+
+    response = jsonify({"points": points, "next": before})
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+# Text, users and destinations of a place, which the map only loads when the place is opened
+@main_bp.route("/place/<int:place_id>", methods=["GET"])
+def place(place_id):
+    record = get_place(place_id)
+    if record is None:
+        abort(404)
+
+    response = Response(record, mimetype="application/json")
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+
+# Entries of the recent feed newer than the cursor of the newest entry the client has, newest first
+@main_bp.route("/recent", methods=["GET"])
+def recent():
+    entries = get_recent(request.args.get("since", ""))
+    if entries is None:
+        abort(404)
+
+    response = Response("[" + ", ".join(entries) + "]", mimetype="application/json")
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+
+# Places added, changed and removed since the version the client has, to update it without loading all places again
+@main_bp.route("/api/delta", methods=["GET"])
+def delta():
+    since = request.args.get("since", type=int)
+    if since is None:
+        abort(400, "since must be the version of the places the client has")
+
+    result = get_delta(since)
+    if result is None:
+        abort(404)
+    version, added, changed, removed = result
+
+    if added is None:
+        body = f'{{"version": {version}, "reset": true}}'
+    else:
+
+        def records(places):
+            return "{" + ", ".join(f'"{place_id}": {record}' for place_id, record in places.items()) + "}"
+
+        body = (
+            f'{{"version": {version}, "reset": false, "added": {records(added)}, "changed": {records(changed)},'
+            f' "removed": [{", ".join(str(place_id) for place_id in removed)}]}}'
+        )
+
+    response = Response(body, mimetype="application/json")
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+
 # Log experience (reviews)
 @main_bp.route("/experience", methods=["POST"])
 def experience():
@@ -47,58 +156,38 @@ def experience():
 
     ip = request.headers.getlist("X-Real-IP")[-1] if request.headers.getlist("X-Real-IP") else request.remote_addr
 
-    lat, lon, dest_lat, dest_lon = map(float, data["coords"].split(","))
+    lat, lon, dest_lat, dest_lon = (float(v) for v in data["coords"].split(","))
 
     assert -90 <= lat <= 90
     assert -180 <= lon <= 180
     assert (-90 <= dest_lat <= 90 and -180 <= dest_lon <= 180) or (math.isnan(dest_lat) and math.isnan(dest_lon))
 
-    for _i in range(10):
-        resp = requests.get(
-            "https://nominatim.openstreetmap.org/reverse",
-            {
-                "lat": lat,
-                "lon": lon,
-                "format": "json",
-                "zoom": 3,
-                "email": current_app.config["EMAIL"],
-            },
-        )
-        if resp.ok:
-            break
-        else:
-            current_app.logger.info(resp)
-
-    res = resp.json()
-    country = "XZ" if "error" in res else res["address"]["country_code"].upper()
-    pid = random.randint(0, 2**63)
-
-    df = pd.DataFrame(
-        [
-            {
-                "rating": rating,
-                "wait": wait,
-                "comment": comment,
-                "nickname": None,
-                "datetime": now,
-                "ip": ip,
-                "reviewed": False,
-                "banned": False,
-                "lat": lat,
-                "dest_lat": dest_lat,
-                "lon": lon,
-                "dest_lon": dest_lon,
-                "country": country,
-                "signal": signal,
-                "ride_datetime": datetime_ride,
-                "user_id": current_user.id if not current_user.is_anonymous else None,
-            }
-        ],
-        index=[pid],
+    # shapely is only loaded by the workers that receive reviews
+    from hitch.geocoder import get_country
+
+    country = get_country(lat, lon)
+    writer.insert_point(
+        {
+            "id": random.randint(0, 2**63 - 1),
+            "rating": rating,
+            "wait": wait,
+            "comment": comment,
+            "nickname": None,
+            "datetime": now,
+            "ip": ip,
+            "reviewed": False,
+            "banned": False,
+            "lat": lat,
+            "dest_lat": dest_lat,
+            "lon": lon,
+            "dest_lon": dest_lon,
+            "country": country,
+            "signal": signal,
+            "ride_datetime": datetime_ride,
+            "user_id": current_user.id if not current_user.is_anonymous else None,
+        }
     )
 
-    df.to_sql("points", get_db(), index_label="id", if_exists="append")
-
     return redirect("/#success")
 
 
@@ -107,27 +196,23 @@ def experience():
 def report_duplicate():
     data = request.form
 
-    now = str(datetime.datetime.utcnow())
+    now = str(datetime.utcnow())
 
     ip = request.headers.getlist("X-Real-IP")[-1] if request.headers.getlist("X-Real-IP") else request.remote_addr
 
-    from_lat, from_lon, to_lat, to_lon = map(float, data["report"].split(","))
-
-    df = pd.DataFrame(
-        [
-            {
-                "datetime": now,
-                "ip": ip,
-                "reviewed": False,
-                "accepted": False,
-                "from_lat": from_lat,
-                "to_lat": to_lat,
-                "from_lon": from_lon,
-                "to_lon": to_lon,
-            }
-        ]
+    from_lat, from_lon, to_lat, to_lon = (float(v) for v in data["report"].split(","))
+
+    writer.insert_duplicate(
+        {
+            "datetime": now,
+            "ip": ip,
+            "reviewed": False,
+            "accepted": False,
+            "from_lat": from_lat,
+            "to_lat": to_lat,
+            "from_lon": from_lon,
+            "to_lon": to_lon,
+        }
     )
 
-    df.to_sql("duplicates", get_db(), index=None, if_exists="append")
-
     return redirect("/#success-duplicate")
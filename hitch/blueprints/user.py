@@ -3,6 +3,8 @@ from flask_security import current_user
 
 from hitch.extensions import security
 from hitch.forms import UserEditForm
+from hitch.helpers import get_db
+from hitch.user_stats import get_user_stats
 
 user_bp = Blueprint("user", __name__)
 
@@ -93,4 +95,6 @@ def show_account(username, is_me: bool = False):
     if user is None:
         return "User not found."
 
-    return render_template("security/account.html", user=user, is_me=is_me)
+    stats = get_user_stats(get_db(), user.id)
+
+    return render_template("security/account.html", user=user, is_me=is_me, stats=stats)
@@ -0,0 +1,134 @@
+import logging
+import os
+
+import simplejson
+
+from hitch.helpers import get_database_path, get_dirs, is_append
+from hitch.metrics import stage
+
+try:
+    import pyarrow as pa
+    from pyarrow import ipc
+except ImportError:  # pyarrow is optional, scripts then read the points from SQLite
+    pa = ipc = None
+
+logger = logging.getLogger(__name__)
+
+# Columnar copy of the points that are not banned, in the order they were submitted. Stored as uncompressed Arrow IPC
+# file, so it can be memory-mapped and only the columns that are used are ever read from disk.
+ARROW_PATH = os.path.join(get_dirs()["db"], "points.arrow")
+
+# Bump when the schema changes, the file is then rebuilt
+ARROW_VERSION = 1
+
+# Rows read from SQLite at once when building the file
+CHUNK_SIZE = 100_000
+
+# Every refresh appends a record batch, they are merged into one once there are more
+MAX_BATCHES = 64
+
+# Datetimes are kept as text, their formats differ between old and new reviews
+if pa is not None:
+    DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+    SCHEMA = pa.schema(
+        [
+            ("point_rowid", pa.int64()),
+            ("id", pa.int64()),
+            ("rating", pa.float64()),
+            ("wait", pa.float64()),
+            ("comment", pa.string()),
+            ("nickname", DICTIONARY),
+            ("datetime", pa.string()),
+            ("reviewed", pa.int64()),
+            ("lat", pa.float64()),
+            ("dest_lat", pa.float64()),
+            ("lon", pa.float64()),
+            ("dest_lon", pa.float64()),
+            ("country", DICTIONARY),
+            ("signal", DICTIONARY),
+            ("ride_datetime", pa.string()),
+            ("user_id", pa.int64()),
+        ]
+    )
+
+QUERY = "select rowid as point_rowid, {} from points where not banned and rowid > ? order by rowid"
+
+
+def get_watermark(con):
+    """Returns the highest rowid, the number of rows and the number of banned rows of the points table"""
+    return list(con.execute("select coalesce(max(rowid), 0), count(*), coalesce(sum(banned), 0) from points").fetchone())
+
+
+def read_batches(con, after=0):
+    """Reads the points that are not banned and whose rowid is greater than `after` as record batches"""
+    cursor = con.execute(QUERY.format(", ".join(SCHEMA.names[1:])), (after,))
+    while rows := cursor.fetchmany(CHUNK_SIZE):
+        columns = zip(*rows, strict=True)
+        yield pa.record_batch([pa.array(values, field.type) for values, field in zip(columns, SCHEMA, strict=True)], SCHEMA)
+
+
+def read_header(path=ARROW_PATH):
+    """Returns the metadata the file was written with, or None if there is no usable file"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with pa.memory_map(path) as source:
+            metadata = ipc.open_file(source).schema.metadata or {}
+    except pa.ArrowInvalid:
+        logger.warning(f"{path} is not a valid Arrow file, rebuilding it")
+        return None
+    header = simplejson.loads(metadata.get(b"hitch", b"null"))
+    return header if header and header["version"] == ARROW_VERSION else None
+
+
+def open_table(path=ARROW_PATH):
+    """Returns the table of the file, memory-mapped so that columns are only read from disk when they are used"""
+    return ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def write_table(table, watermark, database, path=ARROW_PATH):
+    header = {"version": ARROW_VERSION, "database": database, "watermark": watermark}
+    table = table.replace_schema_metadata({"hitch": simplejson.dumps(header)})
+
+    # Unique per process, the daemon and cron jobs may refresh the file at the same time
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    options = ipc.IpcWriteOptions(unify_dictionaries=True)
+    with pa.OSFile(tmp_path, "wb") as sink, ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def refresh(con, path=ARROW_PATH):
+    """Brings the columnar copy of the points up to date with the database
+
+    Reviews submitted since the last refresh are appended, anything else (e.g. bans) rebuilds the file. Edits that do
+    not change the row counts are only picked up by a rebuild, e.g. after deleting the file.
+
+    Returns:
+        The number of rows read from the database
+    """
+    database = get_database_path(con)
+    watermark = get_watermark(con)
+    header = read_header(path)
+    if header is not None and header["database"] != database:
+        header = None
+
+    if header is not None and header["watermark"] == watermark:
+        return 0
+
+    if header is not None and is_append(con, header["watermark"], watermark, "points", ["banned"]):
+        with stage("append columnar points") as s:
+            new = pa.Table.from_batches(list(read_batches(con, header["watermark"][0])), SCHEMA)
+            # The old rows are copied straight from the memory-mapped file
+            table = pa.concat_tables([open_table(path).replace_schema_metadata(None), new]).unify_dictionaries()
+            if table.column(0).num_chunks > MAX_BATCHES:
+                table = table.combine_chunks()
+            write_table(table, watermark, database, path)
+            s.rows_out = new.num_rows
+        return new.num_rows
+
+    with stage("build columnar points") as s:
+        table = pa.Table.from_batches(list(read_batches(con)), SCHEMA)
+        write_table(table, watermark, database, path)
+        s.rows_out = table.num_rows
+    return table.num_rows
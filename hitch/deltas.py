@@ -0,0 +1,119 @@
+import hashlib
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+from hitch.helpers import get_dirs
+
+# Every generation of the places that changed anything gets the next version. For each version, the places that were
+# added, changed or removed by it are kept, so clients can catch up from the version they have (see `get_delta`).
+DELTA_PATH = os.path.join(get_dirs()["db"], "deltas.sqlite")
+
+# Versions whose changes are kept, a day of generations every minute. Older clients load all places again.
+MAX_VERSIONS = 1440
+
+SCHEMA = [
+    "create table if not exists versions (version integer primary key, created text not null)",
+    # Hash of the record of every place of the latest version
+    "create table if not exists places (id integer primary key, hash integer not null)",
+    # The record of every place added or changed by a version, NULL if it was removed
+    """create table if not exists changes (
+        version integer not null,
+        id integer not null,
+        json text,
+        added integer not null,
+        primary key (version, id)
+    )""",
+]
+
+
+def get_hash(record):
+    return int.from_bytes(hashlib.blake2b(record.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def record_version(places, path=DELTA_PATH, max_versions=MAX_VERSIONS):
+    """Compares the places with those of the latest version and stores their differences as a new version
+
+    Args:
+        places: The places as returned by `hitch.scripts.show.build_places`
+
+    Returns:
+        The version of the places, the latest one if nothing changed
+    """
+    con = sqlite3.connect(path)
+    try:
+        with con:
+            for statement in SCHEMA:
+                con.execute(statement)
+
+            latest = con.execute("select max(version) from versions").fetchone()[0]
+            old = dict(con.execute("select id, hash from places"))
+            new = {place_id: (get_hash(record), record) for place_id, record in zip(places.id.tolist(), places.json, strict=True)}
+
+            changes = [(place_id, None, False) for place_id in old.keys() - new.keys()]
+            changes += [
+                (place_id, record, place_id not in old) for place_id, (h, record) in new.items() if old.get(place_id) != h
+            ]
+            if latest is not None and not changes:
+                return latest
+
+            # The first version has no changes, clients start from its files
+            version = (latest or 0) + 1
+            con.execute("insert into versions values (?, ?)", (version, datetime.now(timezone.utc).isoformat(timespec="seconds")))
+            if latest is not None:
+                con.executemany(
+                    "insert into changes values (?, ?, ?, ?)", [(version, place_id, *change) for place_id, *change in changes]
+                )
+
+            con.execute("delete from versions where version <= ?", (version - max_versions,))
+            con.execute("delete from changes where version <= ?", (version - max_versions,))
+
+            con.executemany("delete from places where id = ?", [(place_id,) for place_id, record, _ in changes if record is None])
+            con.executemany(
+                "insert or replace into places values (?, ?)",
+                [(place_id, new[place_id][0]) for place_id, record, _ in changes if record is not None],
+            )
+        return version
+    finally:
+        con.close()
+
+
+def get_delta(since, path=DELTA_PATH):
+    """Returns the changes of all versions after `since`, merged
+
+    Returns:
+        None if there are no versions yet. Otherwise the latest version and the records of the places added and changed
+        since then by id, and the ids of the removed places. The records are None if the client has to load all places
+        again, because its version is unknown or too old.
+    """
+    try:
+        con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        oldest, latest = con.execute("select min(version), max(version) from versions").fetchone()
+        if latest is None:
+            return None
+        # The changes of version v lead from v - 1 to v, all after `since` have to be kept
+        if not (max(oldest - 1, 1) <= since <= latest):
+            return latest, None, None, None
+
+        merged = {}
+        rows = con.execute("select id, json, added from changes where version > ? order by version", (since,))
+        for place_id, record, added in rows:
+            first_added = merged[place_id][1] if place_id in merged else added
+            merged[place_id] = (record, first_added)
+    finally:
+        con.close()
+
+    added, changed, removed = {}, {}, []
+    for place_id, (record, first_added) in merged.items():
+        if record is None:
+            # Places added and removed again since then were never seen by the client
+            if not first_added:
+                removed.append(place_id)
+        elif first_added:
+            added[place_id] = record
+        else:
+            changed[place_id] = record
+    return latest, added, changed, removed
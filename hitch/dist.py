@@ -0,0 +1,148 @@
+import hashlib
+import mimetypes
+import os
+import zlib
+from contextlib import ExitStack
+from functools import lru_cache
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+from hitch.helpers import get_dirs
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, clients then get the gzip version
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional as well, only recent browsers accept zstd
+    zstandard = None
+
+# Trade-off between size and time, the points files are rewritten every minute
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 10
+
+# Files are read and compressed in chunks of this size, so large dumps do not have to fit into memory
+CHUNK_SIZE = 2**20
+
+COMPRESSIBLE = (".json", ".html", ".csv", ".js", ".css", ".svg", ".txt", ".sqlite", ".bin")
+
+# Content-Encoding -> suffix of the precompressed sibling, in order of preference
+ENCODINGS = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+HASH_SUFFIX = ".sha256"
+
+
+def write_dist_file(content, filename):
+    """Writes a file into the dist folder, replacing it atomically so it is never served half-written
+
+    Precompressed siblings and a content hash are written alongside, see `compress_dist_file`.
+
+    Args:
+        content: The text or bytes to be written
+        filename: The filename to be stored into
+    """
+    filepath = os.path.join(get_dirs()["dist"], filename)
+    data = content.encode("utf-8") if isinstance(content, str) else content
+
+    with open(filepath + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(filepath + ".tmp", filepath)
+
+    compress_dist_file(filepath, data)
+
+
+def read_chunks(filepath):
+    with open(filepath, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+def get_compressors():
+    """Returns a (compress, flush) pair of functions for the suffix of every available encoding"""
+    gz = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip header with mtime 0
+    compressors = {".gz": (gz.compress, gz.flush)}
+    if brotli is not None:
+        br = brotli.Compressor(quality=BROTLI_QUALITY)
+        compressors[".br"] = (br.process, br.finish)
+    if zstandard is not None:
+        zst = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        compressors[".zst"] = (zst.compress, zst.flush)
+    return compressors
+
+
+def compress_dist_file(filepath, data=None):
+    """Writes the precompressed siblings and the content hash of a file in the dist folder
+
+    The file is compressed in chunks, so memory does not grow with its size. The siblings are replaced before the
+    hash, so the hash never announces content that is not yet available.
+
+    Args:
+        filepath: The path of the file
+        data: The content of the file, read from disk if not given
+    """
+    compressors = get_compressors() if filepath.endswith(COMPRESSIBLE) else {}
+    digest = hashlib.sha256()
+
+    with ExitStack() as stack:
+        files = {suffix: stack.enter_context(open(filepath + suffix + ".tmp", "wb")) for suffix in compressors}
+        for chunk in [data] if data is not None else read_chunks(filepath):
+            digest.update(chunk)
+            for suffix, (compress, _) in compressors.items():
+                files[suffix].write(compress(chunk))
+        for suffix, (_, flush) in compressors.items():
+            files[suffix].write(flush())
+
+    for suffix in ENCODINGS.values():
+        if suffix in compressors:
+            os.replace(filepath + suffix + ".tmp", filepath + suffix)
+        elif os.path.exists(filepath + suffix):
+            os.remove(filepath + suffix)
+
+    with open(filepath + HASH_SUFFIX + ".tmp", "w", encoding="utf-8") as f:
+        f.write(digest.hexdigest())
+    os.replace(filepath + HASH_SUFFIX + ".tmp", filepath + HASH_SUFFIX)
+
+
+@lru_cache(maxsize=256)
+def read_hash(filepath, generation):
+    """Returns the content hash of a file, cached until its hash file is replaced"""
+    with open(filepath, encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def send_dist_file(path):
+    """Serves a file from the dist folder
+
+    Picks a precompressed sibling according to Accept-Encoding and answers If-None-Match with 304 based on the
+    content hash. Files without a hash (e.g. written by hand) are served as they are.
+    """
+    filepath = safe_join(get_dirs()["dist"], path)
+    if filepath is None or not os.path.isfile(filepath):
+        abort(404)
+
+    try:
+        stat = os.stat(filepath + HASH_SUFFIX)
+        content_hash = read_hash(filepath + HASH_SUFFIX, stat.st_mtime_ns)
+    except FileNotFoundError:
+        return send_file(filepath)
+
+    encoding = next(
+        (e for e in ENCODINGS if request.accept_encodings[e] > 0 and os.path.isfile(filepath + ENCODINGS[e])),
+        None,
+    )
+    mimetype = mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+
+    if encoding is None:
+        response = send_file(filepath, mimetype=mimetype, etag=content_hash, conditional=True)
+    else:
+        response = send_file(
+            filepath + ENCODINGS[encoding], mimetype=mimetype, etag=f"{content_hash}-{encoding}", conditional=True
+        )
+        response.headers["Content-Encoding"] = encoding
+
+    response.vary.add("Accept-Encoding")
+    response.cache_control.no_cache = True
+    return response
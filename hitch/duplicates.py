@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from hitch.geo import haversine_np
+from hitch.helpers import get_dirs
+
+logger = logging.getLogger(__name__)
+
+# Only reports that are not reviewed yet or that were accepted
+DUPLICATES_QUERY = """
+    select rowid, reviewed, accepted, from_lat, from_lon, to_lat, to_lon
+    from duplicates
+    where reviewed = accepted
+    order by rowid
+"""
+# Reports of spots further apart than this (in km) are ignored
+MAX_DISTANCE = 1.25
+
+# The replace map is kept here together with the fingerprint of the duplicates it was built from
+CACHE_PATH = os.path.join(get_dirs()["db"], "replace-map.pickle")
+
+
+def fetch_reports(con):
+    return con.execute(DUPLICATES_QUERY).fetchall()
+
+
+def get_fingerprint(reports):
+    """Hashes the duplicate reports, the replace map only has to be rebuilt when this changes"""
+    return hashlib.sha256(repr(reports).encode("utf-8")).hexdigest()
+
+
+def find_roots(n, edges_from, edges_to):
+    """Union-find over nodes 0..n-1, returns the root of the component every node belongs to"""
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(edges_from.tolist(), edges_to.tolist(), strict=True):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    return np.array([find(x) for x in range(n)], dtype=np.int64)
+
+
+class ReplaceMap:
+    """Maps the coordinates of spots reported as duplicates to the coordinates of the spot they are merged into
+
+    Reports are edges from a duplicate to the spot it duplicates. Within every connected group of spots, the spot that
+    is not reported as duplicate itself is the one all others are merged into. Groups where this is ambiguous (no or
+    multiple such spots) are left alone.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.index = pd.MultiIndex.from_arrays([frame.from_lat, frame.from_lon])
+
+    @classmethod
+    def from_reports(cls, from_lat, from_lon, to_lat, to_lon):
+        from_lat, from_lon, to_lat, to_lon = (np.asarray(a, dtype=np.float64) for a in (from_lat, from_lon, to_lat, to_lon))
+
+        near = haversine_np(from_lon, from_lat, to_lon, to_lat) < MAX_DISTANCE
+        from_lat, from_lon, to_lat, to_lon = from_lat[near], from_lon[near], to_lat[near], to_lon[near]
+
+        # Integer encoding of all reported coordinates
+        coords = np.column_stack([np.concatenate([from_lat, to_lat]), np.concatenate([from_lon, to_lon])])
+        nodes, codes = np.unique(coords, axis=0, return_inverse=True)
+        codes = codes.reshape(-1)
+        edges_from, edges_to = codes[: len(from_lat)], codes[len(from_lat) :]
+
+        roots = find_roots(len(nodes), edges_from, edges_to)
+
+        is_duplicate = np.zeros(len(nodes), dtype=bool)
+        is_duplicate[edges_from] = True
+
+        parents = np.flatnonzero(~is_duplicate)
+        num_parents = np.bincount(roots[parents], minlength=len(nodes))
+        parent_of = np.full(len(nodes), -1, dtype=np.int64)
+        parent_of[roots[parents]] = parents
+
+        replaced = np.flatnonzero(is_duplicate & (num_parents[roots] == 1))
+        targets = parent_of[roots[replaced]]
+
+        return cls(
+            pd.DataFrame(
+                {
+                    "from_lat": nodes[replaced, 0],
+                    "from_lon": nodes[replaced, 1],
+                    "to_lat": nodes[targets, 0],
+                    "to_lon": nodes[targets, 1],
+                }
+            )
+        )
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __getstate__(self):
+        return self.frame
+
+    def __setstate__(self, frame):
+        self.__init__(frame)
+
+    def apply(self, lat, lon):
+        """Returns the merged coordinates for arrays of coordinates"""
+        if len(self.frame) == 0:
+            return np.asarray(lat), np.asarray(lon)
+
+        positions = self.index.get_indexer(pd.MultiIndex.from_arrays([lat, lon]))
+        found = positions >= 0
+        return (
+            np.where(found, self.frame.to_lat.to_numpy()[positions], lat),
+            np.where(found, self.frame.to_lon.to_numpy()[positions], lon),
+        )
+
+    def sources(self, coords):
+        """Returns the coordinates of all spots that are merged into any of the given coordinates"""
+        merged = pd.MultiIndex.from_arrays([self.frame.to_lat, self.frame.to_lon]).isin(list(coords))
+        return list(zip(self.frame.from_lat[merged], self.frame.from_lon[merged], strict=True))
+
+
+def get_replace_map(con):
+    """Returns the replace map for the current duplicate reports, rebuilt only if the reports changed"""
+    reports = fetch_reports(con)
+    fingerprint = get_fingerprint(reports)
+
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH, "rb") as f:
+            cached_fingerprint, replace_map = pickle.load(f)
+        if cached_fingerprint == fingerprint:
+            logger.info(f"Using cached replace map, {len(replace_map)} duplicate spots are merged")
+            return replace_map
+
+    logger.info("Building replace map from duplicates")
+    coords = np.array([report[3:] for report in reports], dtype=np.float64).reshape(-1, 4)
+    replace_map = ReplaceMap.from_reports(*coords.T)
+    logger.info(f"{len(replace_map)} duplicate spots are merged")
+
+    with open(CACHE_PATH + ".tmp", "wb") as f:
+        pickle.dump((fingerprint, replace_map), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(CACHE_PATH + ".tmp", CACHE_PATH)
+
+    return replace_map
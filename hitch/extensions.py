@@ -2,6 +2,9 @@ from flask_mailman import Mail
 from flask_security import Security
 from flask_sqlalchemy import SQLAlchemy
 
+from hitch.writer import Writer
+
 mail = Mail()
 db = SQLAlchemy()
 security = Security()
+writer = Writer()
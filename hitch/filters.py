@@ -0,0 +1,122 @@
+from datetime import date, timedelta
+
+# Reviews per page of /api/points
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+SIGNALS = ["thumb", "sign", "ask", "ask-sign"]
+
+# Public columns of a review, the hitchhiker is named the same way as on the map
+COLUMNS = {
+    "id": "points.rowid",
+    "lat": "points.lat",
+    "lon": "points.lon",
+    "dest_lat": "points.dest_lat",
+    "dest_lon": "points.dest_lon",
+    "rating": "points.rating",
+    "wait": "points.wait",
+    "signal": "points.signal",
+    "country": "points.country",
+    "comment": "points.comment",
+    "datetime": "points.datetime",
+    "ride_datetime": "points.ride_datetime",
+    "hitchhiker": "coalesce(points.nickname, user.username)",
+}
+
+# Old reviews are attributed by nickname, new ones by the account that submitted them. Written as a union of both, so
+# SQLite reads the reviews of the user from the indexes on nickname and user_id (see `hitch.writer.CREATE_INDEXES`). The
+# unary plus keeps it from looking up all reviews without nickname in the index on nickname instead.
+USER_CONDITION = """points.rowid in (
+    select rowid from points where nickname = :user collate nocase
+    union all
+    select rowid from points
+    where user_id in (select id from user where username = :user collate nocase) and +nickname is null
+)"""
+
+
+def parse_range(args, name, convert):
+    """Returns the lower and upper bound of a filter given as <name>_min and <name>_max, each may be missing"""
+    bounds = []
+    for suffix in ["min", "max"]:
+        value = args.get(f"{name}_{suffix}")
+        bounds.append(None if value in [None, ""] else convert(value))
+    return bounds
+
+
+def parse_filters(args):
+    """Returns the filters of a request to /api/points
+
+    Args:
+        args: The query arguments: user, country, signal, rating_min/max, wait_min/max (minutes), ride_min/max (dates as
+            YYYY-MM-DD, both inclusive), limit and before (the id of the last review of the previous page)
+
+    Raises:
+        ValueError: If an argument is malformed
+    """
+    filters = {
+        "user": args.get("user") or None,
+        "country": args.get("country", "").upper() or None,
+        "signal": args.get("signal") or None,
+        "rating": parse_range(args, "rating", float),
+        "wait": parse_range(args, "wait", float),
+        "ride": parse_range(args, "ride", date.fromisoformat),
+        "limit": int(args.get("limit", DEFAULT_LIMIT)),
+        "before": int(args["before"]) if args.get("before") else None,
+    }
+    if filters["signal"] not in SIGNALS + [None]:
+        raise ValueError(f"signal must be one of {', '.join(SIGNALS)}")
+    if not 1 <= filters["limit"] <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    return filters
+
+
+def build_query(filters):
+    """Returns the query of one page of reviews matching the filters, newest submissions first, and its parameters
+
+    One more review than the limit is selected, to tell whether there is a next page.
+    """
+    conditions, params = ["not points.banned"], {"limit": filters["limit"] + 1}
+
+    if filters["user"] is not None:
+        conditions.append(USER_CONDITION)
+        params["user"] = filters["user"]
+    for name in ["country", "signal"]:
+        if filters[name] is not None:
+            conditions.append(f"points.{name} = :{name}")
+            params[name] = filters[name]
+    for name in ["rating", "wait"]:
+        low, high = filters[name]
+        if low is not None:
+            conditions.append(f"points.{name} >= :{name}_min")
+            params[f"{name}_min"] = low
+        if high is not None:
+            conditions.append(f"points.{name} <= :{name}_max")
+            params[f"{name}_max"] = high
+
+    # Ride datetimes are stored as text, with or without a time
+    low, high = filters["ride"]
+    if low is not None:
+        conditions.append("points.ride_datetime >= :ride_min")
+        params["ride_min"] = low.isoformat()
+    if high is not None:
+        conditions.append("points.ride_datetime < :ride_max")
+        params["ride_max"] = (high + timedelta(days=1)).isoformat()
+
+    if filters["before"] is not None:
+        conditions.append("points.rowid < :before")
+        params["before"] = filters["before"]
+
+    query = (
+        f"select {', '.join(f'{sql} as {name}' for name, sql in COLUMNS.items())}"
+        " from points left join user on user.id = points.user_id"
+        f" where {' and '.join(conditions)} order by points.rowid desc limit :limit"
+    )
+    return query, params
+
+
+def fetch_points(con, filters):
+    """Returns one page of reviews matching the filters, and the `before` argument of the next page or None"""
+    query, params = build_query(filters)
+    rows = con.execute(query, params).fetchall()
+    points = [dict(zip(COLUMNS, row, strict=True)) for row in rows[: filters["limit"]]]
+    return points, points[-1]["id"] if len(rows) > filters["limit"] else None
@@ -0,0 +1,117 @@
+import logging
+import os
+import pickle
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from flask import current_app
+
+from hitch.helpers import get_dirs
+
+logger = logging.getLogger(__name__)
+
+# Written by the countries script (flask --app hitch generate countries)
+COUNTRIES_PATH = os.path.join(get_dirs()["db"], "countries.pickle")
+
+# Stored when no country can be determined, same as what Nominatim errors used to result in
+UNKNOWN_COUNTRY = "XZ"
+# Lookups are cached on coordinates rounded to this many decimals (about 100 m)
+PRECISION = 3
+# Spots on the coast can lie just outside of the country borders, these are matched to the nearest country (degrees)
+MAX_DISTANCE = 0.1
+
+# Whether the missing index was logged already, so it is logged once and not on every review
+missing_logged = False
+
+
+class CountryIndex:
+    """STRtree over country polygons, answering point lookups without any network access"""
+
+    def __init__(self, codes, geometries):
+        self.codes = codes
+        self.geometries = np.asarray(geometries)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as f:
+            codes, geometries = pickle.load(f)
+        return cls(codes, geometries)
+
+    def lookup(self, lat, lon):
+        """Returns the country code of the given coordinates, or None if they are not close to any country"""
+        point = shapely.Point(lon, lat)
+
+        candidates = self.tree.query(point)
+        hits = candidates[shapely.intersects_xy(self.geometries[candidates], lon, lat)]
+        if len(hits) == 0:
+            hits = self.tree.query_nearest(point, max_distance=MAX_DISTANCE)
+
+        return self.codes[hits[0]] if len(hits) > 0 else None
+
+
+@lru_cache(maxsize=1)
+def load_index(generation):
+    logger.info(f"Loading country index from {COUNTRIES_PATH}")
+    return CountryIndex.from_file(COUNTRIES_PATH)
+
+
+@lru_cache(maxsize=2**16)
+def lookup_country(lat, lon, generation):
+    return load_index(generation).lookup(lat, lon)
+
+
+def lookup_nominatim(lat, lon):
+    """Asks Nominatim for the country of the given coordinates, returns None if that fails"""
+    import requests
+
+    for _i in range(2):
+        try:
+            resp = requests.get(
+                "https://nominatim.openstreetmap.org/reverse",
+                {
+                    "lat": lat,
+                    "lon": lon,
+                    "format": "json",
+                    "zoom": 3,
+                    "email": current_app.config["EMAIL"],
+                },
+                timeout=current_app.config["NOMINATIM_TIMEOUT"],
+            )
+        except requests.RequestException as e:
+            current_app.logger.info(e)
+            continue
+
+        if resp.ok:
+            res = resp.json()
+            return None if "error" in res else res["address"]["country_code"].upper()
+        else:
+            current_app.logger.info(resp)
+
+    return None
+
+
+def get_country(lat, lon):
+    """Returns the ISO 3166-1 alpha-2 code of the country the coordinates lie in
+
+    Uses the local country index, Nominatim is only asked if the index is missing or has no answer and the
+    NOMINATIM_FALLBACK setting is enabled.
+    """
+    global missing_logged
+    try:
+        generation = os.stat(COUNTRIES_PATH).st_mtime_ns
+    except FileNotFoundError:
+        if not missing_logged:
+            current_app.logger.warning(f"Country index not found at {COUNTRIES_PATH}, run the countries script")
+            missing_logged = True
+        country = None
+    else:
+        missing_logged = False
+        country = lookup_country(round(lat, PRECISION), round(lon, PRECISION), generation)
+
+    if country is None and current_app.config["NOMINATIM_FALLBACK"]:
+        country = lookup_nominatim(lat, lon)
+
+    return country or UNKNOWN_COUNTRY
@@ -1,24 +1,65 @@
 import os
 import sqlite3
 
-import numpy as np
 from flask import current_app, g
 
 
+def connect_db(database, busy_timeout):
+    """Opens a connection in WAL mode, so the generator scripts can read while reviews are written
+
+    Args:
+        database: Path of the SQLite database
+        busy_timeout: Milliseconds to wait for a lock held by another connection
+    """
+    con = sqlite3.connect(database, check_same_thread=False)
+    con.execute(f"pragma busy_timeout = {int(busy_timeout)}")
+    con.execute("pragma journal_mode = wal")
+    con.execute("pragma synchronous = normal")
+    return con
+
+
 def get_db():
     db = getattr(g, "_database", None)
     if db is None:
-        db = g._database = sqlite3.connect(current_app.config["DATABASE_URI"])
+        db = g._database = connect_db(current_app.config["DATABASE_URI"], current_app.config["DATABASE_BUSY_TIMEOUT"])
     return db
 
 
+def close_db(exception=None):
+    db = g.pop("_database", None)
+    if db is not None:
+        db.close()
+
+
+def get_database_path(con):
+    """Returns the path of the main database of a connection"""
+    return next(file for _, name, file in con.execute("pragma database_list") if name == "main")
+
+
+def is_append(con, old, new, table, key):
+    """Whether the rows of `table` only changed by rows appended after the old watermark
+
+    Args:
+        con: Connection to the database
+        old: The old watermark, (max rowid, count, sums of the `key` columns...)
+        new: The new watermark, in the same layout
+        table: The table the watermarks were taken from
+        key: Columns whose sums are part of the watermarks
+    """
+    old_max, old_count = old[:2]
+    columns = ["count(*)"] + [f"coalesce(sum({c}), 0)" for c in key]
+    new_count, *new_sums = con.execute(f"select {', '.join(columns)} from {table} where rowid > ?", (old_max,)).fetchone()
+    return new[1] == old_count + new_count and all(n == o + a for n, o, a in zip(new[2:], old[2:], new_sums, strict=True))
+
+
 def get_dirs():
     scripts_dir = os.path.dirname(__file__)
     root_dir = os.path.abspath(os.path.join(scripts_dir, ".."))
     base_dir = os.path.join(root_dir, "hitch")
-    dist_dir = os.path.join(root_dir, "dist")
+    # Both can be moved, e.g. to generate into a scratch directory (see hitch/benchmark)
+    dist_dir = os.path.abspath(os.getenv("HITCH_DIST_DIR", os.path.join(root_dir, "dist")))
     template_dir = os.path.join(base_dir, "templates")
-    db_dir = os.path.abspath(os.path.join(root_dir, "db"))
+    db_dir = os.path.abspath(os.getenv("HITCH_DB_DIR", os.path.join(root_dir, "db")))
 
     return {
         "scripts": scripts_dir,
@@ -28,36 +69,3 @@ def get_dirs():
         "templates": template_dir,
         "db": db_dir,
     }
-
-
-def haversine_np(lon1, lat1, lon2, lat2, factor=1.25):
-    """
-    Calculate the great circle distance between two points
-    on the earth (specified in decimal degrees)
-
-    All args must be of equal length.
-
-    """
-    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
-
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-
-    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
-
-    c = 2 * np.arcsin(np.sqrt(a))
-    km = 6367 * c
-    # 1.25 because the road distance is, on average, 25% larger than a straight flight
-    return factor * km
-
-
-def get_bearing(lon1, lat1, lon2, lat2):
-    dLon = lon2 - lon1
-    x = np.cos(np.radians(lat2)) * np.sin(np.radians(dLon))
-    y = np.cos(np.radians(lat1)) * np.sin(np.radians(lat2)) - np.sin(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.cos(
-        np.radians(dLon)
-    )
-    brng = np.arctan2(x, y)
-    brng = np.degrees(brng)
-
-    return brng
@@ -0,0 +1,172 @@
+import importlib
+import logging
+import time
+from contextlib import nullcontext
+from functools import cached_property
+
+import pandas as pd
+
+from hitch import columnar
+from hitch.metrics import record, stage
+
+try:
+    import fcntl
+except ImportError:  # Windows, --lockfile is not supported there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Further conditions can be filled in, e.g. to only read the reviews added since the last run
+POINTS_QUERY = "select rowid as point_rowid, * from points where not banned {} order by datetime is not null desc, datetime desc"
+
+
+class Snapshot:
+    """The data all generator jobs of one run work on, every table is read at most once and only if a job needs it
+
+    The frames are shared between jobs, so jobs must not modify them in place (copy the columns they change).
+
+    `flask generate-all` runs every job in a process of its own (see `hitch.scheduler`), each with its own snapshot, so
+    the tables are read once per job there. Jobs that only need some columns read them from the columnar copy through
+    `columns`, which the columnar job brings up to date once before them. show still reads all points from SQLite and
+    dump streams them with SQL.
+    """
+
+    def __init__(self, con):
+        self.con = con
+
+    @cached_property
+    def points(self):
+        """All reviews that are not banned, newest first, with their rowid as `point_rowid`"""
+        with stage("read points") as s:
+            points = pd.read_sql(POINTS_QUERY.format(""), self.con)
+            points["user_id"] = points["user_id"].astype(pd.Int64Dtype())
+            s.rows_out = len(points)
+        return points
+
+    @cached_property
+    def table(self):
+        """The columnar copy of `points` (see `hitch.columnar`), brought up to date once per snapshot"""
+        columnar.refresh(self.con)
+        return columnar.open_table()
+
+    def columns(self, names):
+        """Only the given columns of `points`, in the order the reviews were submitted
+
+        Read from the memory-mapped columnar copy if pyarrow is installed, so the other columns are never loaded.
+        """
+        if columnar.pa is None or "points" in self.__dict__:
+            return self.points.sort_values("point_rowid")[names].reset_index(drop=True)
+
+        with stage("read columns") as s:
+            points = self.table.select(names).to_pandas()
+            for name in points.columns[points.dtypes == "category"]:
+                points[name] = points[name].astype(object)
+            if "user_id" in points:
+                points["user_id"] = points["user_id"].astype(pd.Int64Dtype())
+            s.rows_out = len(points)
+        return points
+
+    @cached_property
+    def users(self):
+        with stage("read users") as s:
+            try:
+                users = pd.read_sql("select id, username from user order by id", self.con)
+            except pd.errors.DatabaseError as err:
+                raise Exception("Run flask init to create the user table") from err
+            s.rows_out = len(users)
+        return users
+
+    @cached_property
+    def duplicates(self):
+        with stage("read duplicates") as s:
+            duplicates = pd.read_sql("select * from duplicates", self.con)
+            s.rows_out = len(duplicates)
+        return duplicates
+
+
+def parse_args(args):
+    """Turns the arguments given on the command line into keyword arguments of a job
+
+    Words are separated by whitespace, `key=value` is passed as a string and a bare `flag` as True,
+    e.g. "incremental" or "source=/tmp/countries.geojson".
+    """
+    kwargs = {}
+    for word in args.split():
+        key, sep, value = word.partition("=")
+        kwargs[key.replace("-", "_")] = value if sep else True
+    return kwargs
+
+
+def run_job(script, snapshot, **kwargs):
+    """Runs the `main` function of a script in hitch/scripts and records its stages
+
+    Args:
+        script: Name of the script, e.g. show
+        snapshot: The `Snapshot` the job reads from
+        kwargs: Arguments of the job
+    """
+    module = importlib.import_module(f"hitch.scripts.{script}")
+    args = " ".join(k if v is True else f"{k}={v}" for k, v in kwargs.items())
+    with record(script, args):
+        return module.main(snapshot, **kwargs)
+
+
+def get_data_version(con):
+    """Returns a number that changes whenever another connection commits to the database"""
+    return con.execute("pragma data_version").fetchone()[0]
+
+
+class FileLock:
+    """Exclusive lock on a file, compatible with the flock command used in cron.sh"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def run_daemon(con, script, kwargs, interval=1.0, debounce=2.0, max_delay=10.0, lockfile=None):
+    """Runs a job once and then again whenever the database changes, until interrupted
+
+    Changes are polled every `interval` seconds. The job runs once no further change came in for `debounce` seconds,
+    but at the latest `max_delay` seconds after the first change, so a steady stream of writes cannot starve it.
+
+    Args:
+        con: Connection to watch, also used by the jobs
+        script: Name of the script, e.g. show
+        kwargs: Arguments of the job
+        interval: Seconds between polls
+        debounce: Seconds without changes to wait for before running the job
+        max_delay: Maximum seconds between a change and the run of the job
+        lockfile: Path of a file that is locked while the job runs, e.g. to not overlap with cron jobs
+    """
+    version = get_data_version(con)
+    # Runs once right away, the output may be older than the data
+    first_change = last_change = time.monotonic() - debounce
+
+    while True:
+        now = time.monotonic()
+        if first_change is not None and (now - last_change >= debounce or now - first_change >= max_delay):
+            logger.info(f"Running {script} after {now - first_change:.1f}s")
+            first_change = None
+            try:
+                with FileLock(lockfile) if lockfile else nullcontext():
+                    run_job(script, Snapshot(con), **kwargs)
+            except Exception:
+                logger.exception(f"{script} failed, waiting for the next change")
+
+        time.sleep(interval)
+
+        new_version = get_data_version(con)
+        if new_version != version:
+            version = new_version
+            last_change = time.monotonic()
+            if first_change is None:
+                first_change = last_change
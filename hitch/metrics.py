@@ -0,0 +1,162 @@
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import simplejson
+
+from hitch.helpers import get_dirs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# One JSON line per run of `flask generate`
+METRICS_PATH = os.path.join(get_dirs()["db"], "metrics.jsonl")
+
+# The file is rotated to metrics.jsonl.1 once it grows beyond this, so at most twice this is kept
+MAX_SIZE = 50 * 2**20
+
+# The run of the script currently executed by `flask generate`, stages outside of a run are not recorded
+current_run = None
+
+
+def get_peak_rss():
+    """Returns the highest resident memory of this process so far in bytes, or None if it is not available"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class Stage:
+    """Measurements of one stage of a script, `rows_in` and `rows_out` can be set while the stage runs"""
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = None
+        self.peak_rss = None
+        self.peak_rss_growth = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "peak_rss_bytes": self.peak_rss,
+            "peak_rss_growth_bytes": self.peak_rss_growth,
+        }
+
+
+class Run:
+    """Measurements of one run of a script, split into stages
+
+    Peak memory is the high-water mark of the whole process, so a stage only shows growth if it needed more memory
+    than all stages before it.
+    """
+
+    def __init__(self, script, args):
+        self.script = script
+        self.args = args
+        self.started = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.stages = []
+        self.status = "ok"
+        self.seconds = None
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        stage = Stage(name, rows_in)
+        peak_before = get_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = round(time.perf_counter() - start, 4)
+            stage.peak_rss = get_peak_rss()
+            if peak_before is not None:
+                stage.peak_rss_growth = stage.peak_rss - peak_before
+            self.stages.append(stage)
+
+    def to_dict(self):
+        return {
+            "script": self.script,
+            "args": self.args,
+            "started": self.started.isoformat(timespec="seconds"),
+            "status": self.status,
+            "seconds": self.seconds,
+            "peak_rss_bytes": get_peak_rss(),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def summary(self):
+        """Returns a table of all stages for the log"""
+
+        def rows(n):
+            return "" if n is None else str(n)
+
+        def megabytes(n):
+            return "" if n is None else f"{n / 2**20:.0f}"
+
+        lines = [f"{self.script} {self.status} in {self.seconds:.2f}s, peak memory {megabytes(get_peak_rss())} MB"]
+        lines.append(f"  {'stage':<30}{'seconds':>9}{'rows in':>10}{'rows out':>10}{'peak MB':>9}{'+MB':>6}")
+        for s in self.stages:
+            lines.append(
+                f"  {s.name:<30}{s.seconds:>9.2f}{rows(s.rows_in):>10}{rows(s.rows_out):>10}"
+                + f"{megabytes(s.peak_rss):>9}{megabytes(s.peak_rss_growth):>6}"
+            )
+        return "\n".join(lines)
+
+
+def append_metrics(run, path=METRICS_PATH):
+    """Appends the run to the metrics file as one JSON line"""
+    if os.path.exists(path) and os.path.getsize(path) > MAX_SIZE:
+        os.replace(path, path + ".1")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(simplejson.dumps(run.to_dict(), ignore_nan=True) + "\n")
+
+
+@contextmanager
+def record(script, args=""):
+    """Records the stages of a script run within this context, then appends them to the metrics file and prints them"""
+    global current_run
+    run = current_run = Run(script, args)
+    try:
+        yield run
+    except BaseException:
+        run.status = "failed"
+        raise
+    finally:
+        current_run = None
+        run.seconds = round(time.perf_counter() - run.start, 4)
+        try:
+            append_metrics(run)
+        except OSError:
+            logger.exception("Could not write metrics")
+        print(run.summary())
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Marks a stage of the running script
+
+    Usage:
+        with stage("read points") as s:
+            points = pd.read_sql(...)
+            s.rows_out = len(points)
+    """
+    if current_run is None:
+        yield Stage(name, rows_in)
+    else:
+        with current_run.stage(name, rows_in) as s:
+            yield s
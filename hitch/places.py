@@ -0,0 +1,107 @@
+import os
+import sqlite3
+
+from hitch.helpers import get_dirs
+
+dirs = get_dirs()
+
+# The JSON record of every place by its id, written by the show script and read by /place/<id>
+PLACE_INDEX_PATH = os.path.join(dirs["db"], "places.sqlite")
+
+# The entries of the recent feed by their cursor (see `format_cursor`), read by /recent
+RECENT_INDEX_PATH = os.path.join(dirs["db"], "recent.sqlite")
+
+
+def write_index(path, statements, insert, rows):
+    """Writes the rows into a new SQLite file that replaces the previous one at once, so readers never see a partial one"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    con = sqlite3.connect(tmp_path)
+    try:
+        for statement in statements:
+            con.execute(statement)
+        con.executemany(insert, rows)
+        con.commit()
+    finally:
+        con.close()
+    os.replace(tmp_path, path)
+
+
+def read_index(path, query, params):
+    """Returns the rows of a query against an index, or None if it was not generated yet"""
+    try:
+        con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        return con.execute(query, params).fetchall()
+    finally:
+        con.close()
+
+
+def write_place_index(places, path=PLACE_INDEX_PATH):
+    """Writes the records of the places into a new index that replaces the previous one at once
+
+    Args:
+        places: The places as returned by `hitch.scripts.show.build_places`
+    """
+    write_index(
+        path,
+        ["create table places (id integer primary key, json text not null)"],
+        "insert into places values (?, ?)",
+        zip(places.id.tolist(), places.json.tolist(), strict=True),
+    )
+
+
+def get_place(place_id, path=PLACE_INDEX_PATH):
+    """Returns the JSON record of a place, or None if there is no place with this id"""
+    rows = read_index(path, "select json from places where id = ?", (place_id,))
+    return rows[0][0] if rows else None
+
+
+def format_cursor(datetime, rowid):
+    """Returns the cursor of a review in the recent feed, <datetime>/<rowid>
+
+    Reviews can be stored with the same datetime, the rowid tells them apart, so no review is skipped by a client whose
+    cursor has the same datetime.
+    """
+    return f"{datetime}/{rowid}"
+
+
+def parse_cursor(cursor):
+    """Returns the datetime and rowid of a cursor
+
+    A cursor without rowid (just a datetime, as before the rowid was added) is taken as before all reviews of that
+    datetime, so none are skipped, some may be returned again.
+    """
+    datetime, sep, rowid = cursor.rpartition("/")
+    if not sep or not rowid.isdigit():
+        return cursor, -1
+    return datetime, int(rowid)
+
+
+def write_recent_index(cursors, records, path=RECENT_INDEX_PATH):
+    """Writes the serialized entries of the recent feed with their cursors"""
+    write_index(
+        path,
+        [
+            "create table recent (datetime text not null, point_rowid integer not null, json text not null)",
+            "create index recent_cursor on recent (datetime, point_rowid)",
+        ],
+        "insert into recent values (?, ?, ?)",
+        ((*parse_cursor(cursor), record) for cursor, record in zip(cursors, records, strict=True)),
+    )
+
+
+def get_recent(since="", path=RECENT_INDEX_PATH):
+    """Returns the serialized entries of the recent feed whose cursor is greater than `since`, newest first, or None if
+    the feed was not generated yet
+    """
+    rows = read_index(
+        path,
+        "select json from recent where (datetime, point_rowid) > (?, ?) order by datetime desc, point_rowid desc",
+        parse_cursor(since),
+    )
+    return rows and [json for (json,) in rows]
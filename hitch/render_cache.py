@@ -0,0 +1,88 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from hitch.helpers import get_dirs
+
+CACHE_PATH = os.path.join(get_dirs()["db"], "render-cache.sqlite")
+
+# Above this many rows the whole table is read instead of looking up the rows one chunk at a time
+FULL_READ_THRESHOLD = 2000
+
+
+def hash_inputs(frame):
+    """Hashes every row of the frame, the rendered HTML of a row is reused as long as this does not change"""
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy().view(np.int64)
+
+
+class RenderCache:
+    """Side table holding the rendered HTML of every review
+
+    Rows are keyed by the rowid of the point and store the hash of all inputs the HTML was rendered from, so a review
+    is only rendered again when one of its inputs changes. Bumping `version` discards everything rendered before.
+
+    Usage:
+        with RenderCache(RENDER_VERSION) as render_cache:
+            found, html = render_cache.lookup(rowids, hashes)
+    """
+
+    def __init__(self, version, path=CACHE_PATH):
+        self.con = sqlite3.connect(path)
+        if self.con.execute("pragma user_version").fetchone()[0] != version:
+            with self.con:
+                self.con.execute("drop table if exists review_html")
+                self.con.execute(f"pragma user_version = {int(version)}")
+        self.con.execute("create table if not exists review_html (point_rowid INTEGER PRIMARY KEY, hash INTEGER, html TEXT)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Commits anything written and closes the connection, e.g. so the daemon does not keep it open between runs"""
+        self.con.commit()
+        self.con.close()
+
+    def lookup(self, rowids, hashes):
+        """Returns which rows have up-to-date HTML and the HTML for those
+
+        Args:
+            rowids: The rowids of the points
+            hashes: The hashes of the current inputs as returned by `hash_inputs`
+        """
+        rowids = np.asarray(rowids, dtype=np.int64)
+        if len(rowids) > FULL_READ_THRESHOLD:
+            cached = pd.read_sql("select * from review_html", self.con)
+        else:
+            cached = pd.concat(
+                [
+                    pd.read_sql(
+                        f"select * from review_html where point_rowid in ({', '.join(['?'] * len(chunk))})",
+                        self.con,
+                        params=chunk.tolist(),
+                    )
+                    for chunk in (rowids[i : i + 500] for i in range(0, max(len(rowids), 1), 500))
+                ]
+            )
+
+        cached = cached.astype({"hash": "Int64"}).set_index("point_rowid").reindex(rowids)
+        found = (cached.hash == hashes).fillna(False).to_numpy(dtype=bool)
+        return found, np.where(found, cached.html.to_numpy(dtype=object), None)
+
+    def store(self, rowids, hashes, html):
+        with self.con:
+            self.con.executemany(
+                "insert or replace into review_html (point_rowid, hash, html) values (?, ?, ?)",
+                zip(np.asarray(rowids).tolist(), np.asarray(hashes).tolist(), html, strict=True),
+            )
+
+    def prune(self, rowids):
+        """Removes the HTML of all points except the given ones, e.g. after they were banned"""
+        cached = pd.read_sql("select point_rowid from review_html", self.con).point_rowid
+        stale = cached[~cached.isin(rowids)]
+        with self.con:
+            self.con.executemany("delete from review_html where point_rowid = ?", ((r,) for r in stale.tolist()))
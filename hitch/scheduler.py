@@ -0,0 +1,169 @@
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing.connection import wait
+
+logger = logging.getLogger(__name__)
+
+# Seconds a job may run before it is stopped, unless it sets its own
+DEFAULT_TIMEOUT = 30 * 60
+
+
+class Job:
+    """A generator script with the data it reads and writes
+
+    Inputs and outputs are names of data sets: tables of the database (e.g. points), files in db (e.g. points.arrow) or
+    files in dist (e.g. dist/dump.sqlite). A job waits for every job that writes one of its inputs, jobs writing the
+    same output run in the order they are listed. All other jobs run at the same time.
+    """
+
+    def __init__(self, script, inputs=(), outputs=(), args="", timeout=DEFAULT_TIMEOUT):
+        self.script = script
+        self.inputs = set(inputs)
+        self.outputs = set(outputs)
+        self.args = args
+        self.timeout = timeout
+
+
+# The jobs of `flask generate-all`, the slowest ones first, so they start right away
+JOBS = [
+    Job("hitchhiking", inputs=["static/map.js"], outputs=["gp-raster", "dist/hitchhiking.html"], timeout=3 * 60 * 60),
+    Job(
+        "show",
+        inputs=["points", "users", "duplicates"],
+        outputs=["show-state.pickle", "places.sqlite", "recent.sqlite", "deltas.sqlite", "dist/points", "dist/tiles"],
+    ),
+    Job("columnar", inputs=["points"], outputs=["points.arrow"]),
+    # Used when reviews are submitted, only built if it is missing, `flask generate countries` rebuilds it
+    Job("countries", outputs=["countries.pickle"], args="missing-only"),
+    Job("user_stats", inputs=["points.arrow", "users"], outputs=["user_stats"]),
+    Job("dump", inputs=["points", "duplicates"], outputs=["dist/dump.sqlite", "dist/dump.csv"]),
+    Job("dashboard", inputs=["points.arrow", "users", "duplicates"], outputs=["dist/dashboard.html"]),
+]
+
+
+def get_dependencies(jobs):
+    """Returns the scripts every job has to wait for, by script
+
+    Raises:
+        ValueError: If the jobs depend on each other in a cycle
+    """
+    dependencies = {}
+    for i, job in enumerate(jobs):
+        dependencies[job.script] = {
+            other.script
+            for j, other in enumerate(jobs)
+            if other is not job and (job.inputs & other.outputs or (j < i and job.outputs & other.outputs))
+        }
+
+    # Jobs are removed once all their dependencies are, whatever remains depends on itself
+    remaining = dict(dependencies)
+    while remaining:
+        ready = [script for script, waits_for in remaining.items() if not waits_for & remaining.keys()]
+        if not ready:
+            raise ValueError(f"The jobs {', '.join(remaining)} depend on each other")
+        for script in ready:
+            del remaining[script]
+    return dependencies
+
+
+def run_worker(script, args):
+    """Runs one job in a process of its own, with its own app, connection and snapshot"""
+    from hitch import create_app
+    from hitch.helpers import get_db
+    from hitch.jobs import Snapshot, parse_args, run_job
+
+    with create_app().app_context():
+        run_job(script, Snapshot(get_db()), **parse_args(args))
+
+
+def run(jobs, workers=None, timeout=None):
+    """Runs the jobs in separate processes, as many at the same time as there are workers
+
+    Every job gets a fresh process, so one that runs too long can be stopped and the memory of one job is given back
+    before the next one starts. A job that fails does not stop the others, only those that depend on it are skipped.
+
+    Args:
+        jobs: The `Job`s to run
+        workers: Maximum number of jobs running at the same time, by default the number of CPUs
+        timeout: Seconds after which every job is stopped, overrides the timeouts of the jobs
+
+    Returns:
+        The script, status (ok, failed, timeout or skipped), start and seconds of every job, in the order of `jobs`
+    """
+    dependencies = get_dependencies(jobs)
+    workers = max(1, workers or os.cpu_count() or 1)
+    # Spawned processes do not share the connections, locks and threads of this one
+    context = multiprocessing.get_context("spawn")
+
+    start = time.monotonic()
+    pending, running, results = list(jobs), {}, {}
+    try:
+        while pending or running:
+            for job in list(pending):
+                failed = [script for script in dependencies[job.script] if results.get(script, {}).get("status", "ok") != "ok"]
+                if failed:
+                    logger.warning(f"Skipping {job.script}, {', '.join(failed)} did not succeed")
+                    results[job.script] = {"script": job.script, "status": "skipped", "start": None, "seconds": None}
+                    pending.remove(job)
+
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                if dependencies[job.script] <= results.keys():
+                    process = context.Process(target=run_worker, args=(job.script, job.args), name=f"hitch-{job.script}")
+                    process.start()
+                    running[process.sentinel] = (job, process, time.monotonic())
+                    pending.remove(job)
+
+            if not running:
+                continue
+
+            now = time.monotonic()
+            deadline = min(started + (timeout or job.timeout) for job, _, started in running.values())
+            finished = wait(list(running), timeout=max(0, deadline - now))
+
+            now = time.monotonic()
+            for sentinel, (job, process, started) in list(running.items()):
+                if sentinel in finished:
+                    process.join()
+                    status = "ok" if process.exitcode == 0 else "failed"
+                elif now - started >= (timeout or job.timeout):
+                    logger.error(f"Stopping {job.script} after {now - started:.0f}s")
+                    process.kill()
+                    process.join()
+                    status = "timeout"
+                else:
+                    continue
+
+                del running[sentinel]
+                results[job.script] = {
+                    "script": job.script,
+                    "status": status,
+                    "start": round(started - start, 4),
+                    "seconds": round(now - started, 4),
+                }
+    finally:
+        # e.g. interrupted, no job is left running in the background
+        for _, process, _ in running.values():
+            process.kill()
+            process.join()
+
+    return [results[job.script] for job in jobs]
+
+
+def format_summary(results, seconds, workers):
+    """Returns a table of the jobs for the log, with the wall time of the whole run"""
+
+    def number(n):
+        return "" if n is None else f"{n:.2f}"
+
+    failed = sum(result["status"] != "ok" for result in results)
+    total = sum(result["seconds"] or 0 for result in results)
+    lines = [f"{len(results)} jobs in {seconds:.2f}s ({total:.2f}s of jobs) with {workers} workers, {failed} did not succeed"]
+    lines.append(f"  {'job':<20}{'status':>10}{'start':>10}{'seconds':>10}")
+    for result in results:
+        started, took = number(result["start"]), number(result["seconds"])
+        lines.append(f"  {result['script']:<20}{result['status']:>10}{started:>10}{took:>10}")
+    return "\n".join(lines)
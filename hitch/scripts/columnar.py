@@ -0,0 +1,21 @@
+import logging
+
+from hitch import columnar
+
+logger = logging.getLogger(__name__)
+
+
+def main(snapshot):
+    """Brings the columnar copy of the points up to date (see `hitch.columnar`)
+
+    Run by `flask generate-all` before the jobs reading it, so they do not each refresh it at the same time.
+
+    Args:
+        snapshot: The data of this run, only its connection is used
+    """
+    if columnar.pa is None:
+        logger.info("pyarrow is not installed, the points are read from the database")
+        return
+
+    rows = columnar.refresh(snapshot.con)
+    logger.info(f"Read {rows} points into {columnar.ARROW_PATH}")
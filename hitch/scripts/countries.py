@@ -0,0 +1,60 @@
+import logging
+import os
+import pickle
+import re
+
+import requests
+import shapely
+import simplejson
+from shapely.geometry import shape
+
+from hitch.geocoder import COUNTRIES_PATH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Natural Earth admin 0 countries, the 10m scale is needed to get border crossings right
+SOURCE = "https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_10m_admin_0_countries.geojson"
+
+# ISO_A2 is -99 for some countries (e.g. France, Norway, Kosovo), the other fields fill in for those
+CODE_FIELDS = ["ISO_A2_EH", "ISO_A2", "WB_A2"]
+
+
+def main(snapshot, source=SOURCE, missing_only=False):
+    """Builds the country index used to look up the country of new reviews
+
+    Args:
+        snapshot: The data of this run (unused)
+        source: Local path or URL of a GeoJSON file with country borders
+        missing_only: Only build the index if it does not exist yet, e.g. on every start of the server
+    """
+    if missing_only and os.path.exists(COUNTRIES_PATH):
+        logger.info(f"Country index exists at {COUNTRIES_PATH}")
+        return
+
+    if os.path.exists(source):
+        logger.info(f"Reading countries from {source}")
+        with open(source, encoding="utf-8") as f:
+            features = simplejson.load(f)["features"]
+    else:
+        logger.info(f"Downloading countries from {source}")
+        resp = requests.get(source, timeout=60)
+        resp.raise_for_status()
+        features = resp.json()["features"]
+
+    codes = []
+    geometries = []
+    for feature in features:
+        properties = feature["properties"]
+        code = next((properties[field] for field in CODE_FIELDS if re.fullmatch("[A-Z]{2}", properties.get(field) or "")), None)
+        if code is None or feature["geometry"] is None:
+            logger.info(f"Skipping country without code: {properties.get('NAME')}")
+            continue
+
+        codes.append(code)
+        geometries.append(shapely.make_valid(shape(feature["geometry"])))
+
+    logger.info(f"Writing {len(codes)} countries to {COUNTRIES_PATH}")
+    with open(COUNTRIES_PATH + ".tmp", "wb") as f:
+        pickle.dump((codes, geometries), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(COUNTRIES_PATH + ".tmp", COUNTRIES_PATH)
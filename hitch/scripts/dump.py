@@ -1,24 +1,112 @@
+import csv
 import os
 import sqlite3
+import urllib.parse
 
-import pandas as pd
-
-from hitch.helpers import get_db, get_dirs
+from hitch.dist import compress_dist_file
+from hitch.helpers import get_database_path, get_dirs
+from hitch.metrics import stage
 
 dirs = get_dirs()
 
-os.makedirs(dirs["dist"], exist_ok=True)
-
 DATABASE_DUMP = os.path.join(dirs["dist"], "dump.sqlite")
 CSV_DUMP = os.path.join(dirs["dist"], "dump.csv")
 
-all_points = pd.read_sql("select * from points where not banned", get_db())
-all_points["ip"] = ""
-all_points.to_sql("points", sqlite3.connect(DATABASE_DUMP), index=False, if_exists="replace")
+# Rows fetched at once when writing the CSV, memory stays the same whatever the number of reviews
+CHUNK_SIZE = 10_000
+
+# Published tables with the condition on their rows, columns that are not public are blanked
+TABLES = {"points": "not banned", "duplicates": "reviewed = accepted"}
+BLANKED = ["ip"]
+
+# pandas wrote integer columns with NULLs as REAL (e.g. 120.0 in the CSV), the published files keep that format
+REAL_COLUMNS = ["user_id"]
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def copy_table(dump, table, where):
+    """Copies the rows of a table of the attached source database into the dump, in the order they were submitted
+
+    SQLite copies the rows itself, nothing is loaded into Python.
+
+    Returns:
+        The number of copied rows
+    """
+    columns = [
+        (name, "REAL" if name in REAL_COLUMNS else type_)
+        for _, name, type_, *_ in dump.execute(f"pragma src.table_info({quote(table)})")
+    ]
+    dump.execute(f"create table {quote(table)} ({', '.join(f'{quote(name)} {type_}' for name, type_ in columns)})")
+
+    def expression(name):
+        if name in BLANKED:
+            return f"'' as {quote(name)}"
+        if name in REAL_COLUMNS:
+            return f"cast({quote(name)} as real) as {quote(name)}"
+        return quote(name)
+
+    select = ", ".join(expression(name) for name, _ in columns)
+    cursor = dump.execute(
+        f"insert into {quote(table)} select {select} from src.{quote(table)} where {where} order by rowid",
+    )
+    return cursor.rowcount
+
+
+def write_csv(dump, table, filepath):
+    """Writes a table of the dump as CSV in chunks, formatted the way pandas' `to_csv` did
+
+    Returns:
+        The number of written rows
+    """
+    cursor = dump.execute(f"select * from {quote(table)} order by rowid")
+    rows = 0
+    with open(filepath, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow([column[0] for column in cursor.description])
+        while chunk := cursor.fetchmany(CHUNK_SIZE):
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def main(snapshot):
+    """Writes all public reviews and duplicate reports as SQLite database and the reviews as CSV file
+
+    Both are streamed from the database, so memory does not grow with the number of reviews. The files are written
+    next to the published ones and replace them once complete, compressed siblings (e.g. dump.csv.gz) follow.
+
+    Args:
+        snapshot: The data of this run (see `hitch.jobs.Snapshot`), only its connection is used
+    """
+    os.makedirs(dirs["dist"], exist_ok=True)
+
+    for path in [DATABASE_DUMP + ".tmp", DATABASE_DUMP + ".tmp-journal"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+    dump = sqlite3.connect(DATABASE_DUMP + ".tmp", isolation_level=None, uri=True)
+    try:
+        source = get_database_path(snapshot.con)
+        dump.execute("attach database ? as src", (f"file:{urllib.parse.quote(source)}?mode=ro",))
+
+        # Both tables are read in one transaction, so they are from the same state of the database
+        with stage("write sqlite") as s:
+            dump.execute("begin")
+            s.rows_out = sum(copy_table(dump, table, where) for table, where in TABLES.items())
+            dump.execute("commit")
+            dump.execute("detach database src")
 
+        with stage("write csv") as s:
+            s.rows_out = write_csv(dump, "points", CSV_DUMP + ".tmp")
+    finally:
+        dump.close()
 
-duplicates = pd.read_sql("select * from duplicates where reviewed = accepted", get_db())
-duplicates["ip"] = ""
-duplicates.to_sql("duplicates", sqlite3.connect(DATABASE_DUMP), index=False, if_exists="replace")
+    os.replace(DATABASE_DUMP + ".tmp", DATABASE_DUMP)
+    os.replace(CSV_DUMP + ".tmp", CSV_DUMP)
 
-all_points.to_csv(CSV_DUMP, index=False)
\ No newline at end of file
+    with stage("compress"):
+        compress_dist_file(DATABASE_DUMP)
+        compress_dist_file(CSV_DUMP)
@@ -1,75 +1,166 @@
-import os
+import base64
+import io
 
-import folium
 import numpy as np
-import pandas as pd
-from matplotlib import cm, colors
+import simplejson
 
-from hitch.helpers import get_db, get_dirs, haversine_np
+from hitch.dist import write_dist_file
+from hitch.geo import haversine_np
+from hitch.metrics import stage
+from hitch.tiles import MAX_LAT
 
-dirs = get_dirs()
+# Label, unit, colormap and the position on the colormap of an average
+METRICS = {
+    "speed": ("Distance per waiting time", "km/min", "RdYlGn", lambda v: np.minimum(v, 5) / 5),
+    "wait": ("Waiting time", "min", "RdYlGn", lambda v: 0.9 - 0.9 * np.minimum(v, 120) / 120),
+    "distance": ("Distance", "km", "RdYlGn", lambda v: 0.9 * np.minimum(v, 120) / 120),
+    "count": ("Reviews", "reviews", "viridis", lambda v: np.minimum(np.log10(v) / 3, 1)),
+}
 
-points = pd.read_sql(
-    "select * from points where not banned order by datetime is not null desc, datetime desc",
-    get_db(),
-)
+OPACITY = 0.3
 
 
-rads = points[["lon", "lat", "dest_lon", "dest_lat"]].values.T
+def mercator(lat):
+    """Projects latitudes to Web Mercator, those beyond its limits (e.g. reviews at a pole) onto its edges"""
+    return np.log(np.tan(np.pi / 4 + np.radians(np.clip(lat, -MAX_LAT, MAX_LAT)) / 2))
 
-VAR = "distance"
-DIVIDER = "wait"
 
-points["distance"] = haversine_np(*rads, 1)
+def inverse_mercator(y):
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
 
-# points = points[points.datetime > '2021']
-if "distance" in [VAR, DIVIDER]:
-    points = points[points.distance > 0]
 
-bin_groups = [pd.cut(points.lat, 100), pd.cut(points.lon, 100)]
+def get_cells(lat, lon, resolution):
+    """Returns the cell of every point on a grid of resolution x resolution cells over the extent of the points
 
-stacked_grid = points.groupby(bin_groups)[VAR].mean()
+    Rows are equally high in Web Mercator, so the grid can be shown as an image on the map without reprojecting it.
 
-if DIVIDER:
-    stacked_grid /= points.groupby(bin_groups)[DIVIDER].mean()
+    Returns:
+        The flat index of the cell of every point (row 0 is the southernmost), and the bounds of the grid as
+        [[south, west], [north, east]]
+    """
+    y = mercator(lat)
+    y_min, y_max, lon_min, lon_max = y.min(), y.max(), lon.min(), lon.max()
 
-stacked_grid_counts = points.groupby(bin_groups)[VAR].count()
-stacked_grid[stacked_grid_counts < 4] = np.nan
-grid = stacked_grid.unstack()
-grid_counts = stacked_grid_counts.unstack()
-grid = grid.iloc[::-1]
-grid_counts = grid_counts.iloc[::-1]
+    def index(values, low, high):
+        return np.minimum(((values - low) / max(high - low, 1e-9) * resolution).astype(int), resolution - 1)
 
+    cells = index(y, y_min, y_max) * resolution + index(lon, lon_min, lon_max)
+    return cells, [[float(inverse_mercator(y_min)), float(lon_min)], [float(inverse_mercator(y_max)), float(lon_max)]]
 
-m = folium.Map(prefer_canvas=True, control_scale=True)
 
-# log_grid = stacked_grid.apply(lambda x: np.emath.logn(x, 2 ** .5))
+def compute_grids(points, resolution, min_count):
+    """Averages all metrics per grid cell, binning the points only once
 
-for (lat, lon), g in stacked_grid.items():
-    if g == g:
-        if VAR == "distance" and DIVIDER == "wait":
-            val = cm.RdYlGn(min(g, 5) / 5)
-            tooltip = f"{round(g, 1)} km/min"
-        elif VAR == "wait":
-            val = cm.RdYlGn(0.9 - 0.9 * min(g, 120) / 120)
-            tooltip = f"{int(g)} min"
-        elif VAR == "distance":
-            val = cm.RdYlGn(0.9 * min(g, 120) / 120)
-            tooltip = f"{int(g)} km"
-        c = colors.rgb2hex(val)
-        folium.Rectangle(
-            bounds=[[lat.left, lon.left], [lat.right, lon.right]],
-            stroke=False,
-            fill=True,
-            fill_color=c,
-            fill_opacity=0.3,
-            tooltip=tooltip,
-        ).add_to(m)
+    Averages of cells with fewer than `min_count` values are NaN.
+
+    Returns:
+        The averages of every metric as resolution x resolution array, and the bounds of the grid
+    """
+    cells, bounds = get_cells(points.lat.to_numpy(), points.lon.to_numpy(), resolution)
+    wait, distance = points.wait.to_numpy(), points.distance.to_numpy()
+
+    def total(mask, weights=None):
+        return np.bincount(cells[mask], None if weights is None else weights[mask], minlength=resolution**2)
+
+    has_wait = ~np.isnan(wait)
+    has_distance = distance > 0
+    has_both = has_wait & has_distance
+
+    counts = {
+        "wait": total(has_wait),
+        "distance": total(has_distance),
+        "count": total(np.ones(len(cells), dtype=bool)),
+    }
+    counts["speed"] = counts["distance"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = {
+            "wait": total(has_wait, wait) / counts["wait"],
+            "distance": total(has_distance, distance) / counts["distance"],
+            "count": counts["count"].astype(float),
+        }
+        # Average distance of the rides divided by the average wait of those with both
+        means["speed"] = means["distance"] / (total(has_both, wait) / total(has_both))
+
+    grids = {}
+    for metric, values in means.items():
+        values[counts[metric] < (1 if metric == "count" else min_count)] = np.nan
+        grids[metric] = values.reshape(resolution, resolution)
+    return grids, bounds
 
-# bounds = [[grid_.index.min().left, grid_.columns.min().left],
-#           [grid_.index.max().right, grid_.columns.max().right]]
-# ImageOverlay(grid_counts.values, bounds, opacity=.5).add_to(m)
-if DIVIDER:
-    m.save(os.path.abspath(os.path.join(dirs["dist"], f"heatmap-{VAR}-per-{DIVIDER}.html")))
-else:
-    m.save(os.path.abspath(os.path.join(dirs["dist"], f"heatmap-{VAR}.html")))
+
+def render_png(grid, metric):
+    """Returns the grid as PNG, north up, with transparent cells where there is no average"""
+    from matplotlib import colormaps
+    from matplotlib.image import imsave
+
+    _, _, colormap, position = METRICS[metric]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rgba = colormaps[colormap](position(grid))
+    rgba[..., 3] = np.where(np.isnan(grid), 0, OPACITY)
+
+    buffer = io.BytesIO()
+    imsave(buffer, rgba[::-1], format="png")
+    return buffer.getvalue()
+
+
+def render_html(images):
+    """Returns a map with every image as a layer, only the first one is shown initially"""
+    import folium
+
+    m = folium.Map(prefer_canvas=True, control_scale=True)
+    for i, image in enumerate(images):
+        label, unit, _, _ = METRICS[image["metric"]]
+        folium.raster_layers.ImageOverlay(
+            "data:image/png;base64," + base64.b64encode(image["png"]).decode("ascii"),
+            image["bounds"],
+            name=f"{label} in {unit} ({image['resolution']} cells)",
+            show=i == 0,
+        ).add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m.get_root().render()
+
+
+def parse_list(value):
+    return [v for v in str(value).split(",") if v]
+
+
+def main(snapshot, metrics="speed,wait,distance,count", resolution="100", output="html", min_count="4"):
+    """Generates heatmaps of the average waiting time, ride distance and distance per waiting time and of the number
+    of reviews per grid cell
+
+    Args:
+        snapshot: The data of this run (see `hitch.jobs.Snapshot`)
+        metrics: Comma separated metrics, out of speed (km/min), wait, distance and count
+        resolution: Comma separated numbers of cells along each axis, every metric is rendered at every resolution
+        output: html for one map with a layer per image (heatmap.html), png for the images and their bounds
+            (heatmap-<metric>-<resolution>.png and heatmap.json), e.g. to be overlaid on another map
+        min_count: Fewest values needed to show the average of a cell
+    """
+    metrics, resolutions = parse_list(metrics), [int(r) for r in parse_list(resolution)]
+    unknown = set(metrics) - set(METRICS)
+    if unknown or output not in ["html", "png"]:
+        raise ValueError(f"Unknown metrics {sorted(unknown)} or output {output}, see the docstring of heatmap.main")
+
+    points = snapshot.columns(["lat", "lon", "dest_lat", "dest_lon", "wait"])
+    points = points.dropna(subset=["lat", "lon"])
+    points["distance"] = haversine_np(*points[["lon", "lat", "dest_lon", "dest_lat"]].to_numpy().T, 1)
+
+    images = []
+    for res in resolutions:
+        with stage(f"grid {res}", rows_in=len(points)) as s:
+            grids, bounds = compute_grids(points, res, int(min_count))
+            s.rows_out = int((~np.isnan(grids["count"])).sum())
+
+        with stage(f"render {res}") as s:
+            for metric in metrics:
+                images.append({"metric": metric, "resolution": res, "bounds": bounds, "png": render_png(grids[metric], metric)})
+
+    with stage("write", rows_in=len(images)):
+        if output == "html":
+            write_dist_file(render_html(images), "heatmap.html")
+        else:
+            for image in images:
+                image["file"] = f"heatmap-{image['metric']}-{image['resolution']}.png"
+                write_dist_file(image.pop("png"), image["file"])
+            write_dist_file(simplejson.dumps(images), "heatmap.json")
@@ -1,107 +1,215 @@
+import contextlib
+import errno
+import hashlib
 import logging
 import os
+import shutil
+from importlib.metadata import version
 from string import Template
 
-import branca.colormap as cm
-import folium
-import matplotlib.colors as colors
 import numpy as np
-import xyzservices.providers as xyz
-from heatchmap.gpmap import GPMap
-from heatchmap.map_based_model import BOUNDARIES, BUCKETS
+import simplejson
 
+from hitch.dist import write_dist_file
 from hitch.helpers import get_dirs
+from hitch.metrics import stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-BUCKETS = BUCKETS[:-1]
-BOUNDARIES = BOUNDARIES[:-1]
-
 DIRS = get_dirs()
 
-
-outname = os.path.join(DIRS["dist"], "hitchhiking.html")
-template_path = os.path.join(DIRS["templates"], "index_template.html")
-
-tiles = xyz.CartoDB.Positron
-folium_map = folium.Map(
-    tiles=folium.TileLayer(no_wrap=True, tiles=tiles),
-    attr="Heatchmap",
-    min_zoom=1,
-    max_zoom=5,
-)
-
-
-cmap = colors.ListedColormap(BUCKETS)
-
-norm = colors.BoundaryNorm(BOUNDARIES, cmap.N, clip=True)
-cmap.set_bad(color="#000000", alpha=0.0)  # opaque for NaN values (sea)
-
-gpmap = GPMap()
-gpmap.get_map_grid()
-gpmap.get_landmass_raster()
-
-image = gpmap.raw_raster
-image = np.where(gpmap.landmass_raster, image, np.nan)
-image = norm(image).data
-# Apply the colormap to scalars
-colors = cmap(image)
-
-uncertainties = gpmap.uncertainties
-# no uncertainties for sea -> becomes fully transparent
-uncertainties = np.where(gpmap.landmass_raster, uncertainties, uncertainties.max())
-# Normalize uncertainties
-uncertainties = (uncertainties - uncertainties.min()) / (uncertainties.max() - uncertainties.min())
-uncertainties = 1 - uncertainties
-
-# Combine RGB values with the opacity
-rgba_array = np.empty_like(colors)
-rgba_array[:, :, :3] = colors[:, :, :3]  # RGB
-rgba_array[:, :, 3] = uncertainties
-
-folium.raster_layers.ImageOverlay(
-    image=rgba_array,
-    bounds=[[-56, -180], [80, 180]],
-).add_to(folium_map)
-
-
-legend = cm.LinearColormap(colors=BUCKETS, index=BOUNDARIES[:-1], vmin=BOUNDARIES[0], vmax=BOUNDARIES[-1])
-legend.caption = "Waiting time to catch a ride by hitchhiking (minutes)"
-folium_map.add_child(legend)
-
-### from show.py ###
-folium_map.get_root().render()
-
-header = folium_map.get_root().header.render()
-header = header.replace(
-    '<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/css/bootstrap.min.css"/>',
-    '<link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.2.0/css/bootstrap.min.css">',
-)
-header = header.replace(
-    '<link rel="stylesheet" href="https://netdna.bootstrapcdn.com/bootstrap/3.0.0/css/bootstrap.min.css"/>',
-    '<link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.2.0/css/bootstrap-theme.min.css">',
-)
-body = folium_map.get_root().html.render()
-script = folium_map.get_root().script.render()
-
-with (
-    open(template_path, encoding="utf-8") as template,
-    open(os.path.join(DIRS["base"], "static", "map.js"), encoding="utf-8") as js,
-    open(os.path.join(DIRS["base"], "static", "style.css"), encoding="utf-8") as css,
-    open(outname, "w", encoding="utf-8") as out,
-):
-    output = Template(template.read()).substitute(
-        {
-            "folium_head": header,
-            "folium_body": body,
-            "folium_script": script,
-            "hitch_script": js.read(),
-            "hitch_style": css.read(),
-        }
+# Computing the rasters takes long, they are kept as .npy files in a directory per cache key
+RASTER_CACHE = os.path.join(DIRS["db"], "gp-raster")
+RASTERS = ["raw_raster", "uncertainties", "landmass_raster"]
+
+# Suffixes of the directories of rasters that are being written or replaced
+PARTIAL = (".tmp", ".old")
+
+# GPMap loads the latest map (one split per date) from this dataset, the rasters come from there and not from our reviews
+MAP_DATASET = "tillwenke/heatchmap-map"
+
+
+def get_map_revision():
+    """Returns the latest commit of the dataset of maps, every new map is a new commit, or None if it cannot be looked up"""
+    from huggingface_hub import HfApi
+
+    try:
+        return HfApi().dataset_info(MAP_DATASET).sha
+    except Exception as e:
+        logger.warning(f"Could not look up the latest map of {MAP_DATASET}: {e}")
+        return None
+
+
+def get_cache_key(revision):
+    """Identifies the rasters by the version of the model and the revision of the dataset of maps it loads"""
+    inputs = {"heatchmap": version("heatchmap"), "map": revision}
+    return hashlib.sha256(simplejson.dumps(inputs).encode("utf-8")).hexdigest()[:16]
+
+
+def load_rasters(key=None):
+    """Returns the cached rasters memory-mapped, or None if they are not cached
+
+    Without a key, e.g. when the revision of the maps cannot be looked up, the rasters cached last are returned.
+    """
+    if key is None:
+        keys = [entry for entry in os.listdir(RASTER_CACHE) if not entry.endswith(PARTIAL)] if os.path.isdir(RASTER_CACHE) else []
+        if not keys:
+            return None
+        key = keys[0]
+
+    path = os.path.join(RASTER_CACHE, key)
+    if not all(os.path.exists(os.path.join(path, f"{name}.npy")) for name in RASTERS):
+        return None
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in RASTERS}
+
+
+def compute_rasters():
+    """Loads the latest map of the model and computes which pixels are land"""
+    from heatchmap.gpmap import GPMap
+
+    gpmap = GPMap()
+    gpmap.get_map_grid()
+    gpmap.get_landmass_raster()
+    return {name: np.asarray(getattr(gpmap, name)) for name in RASTERS}
+
+
+def save_rasters(key, rasters):
+    """Stores the rasters under the key, replacing those cached under it already, and removes those of all other keys"""
+    path = os.path.join(RASTER_CACHE, key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path)
+    for name, raster in rasters.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), raster)
+
+    for entry in os.listdir(RASTER_CACHE):
+        if entry != key and not entry.endswith(PARTIAL):
+            shutil.rmtree(os.path.join(RASTER_CACHE, entry))
+
+    # A directory cannot replace a non-empty one, e.g. after --args refresh the old rasters are moved aside first
+    old_path = f"{path}.{os.getpid()}.old"
+    with contextlib.suppress(FileNotFoundError):
+        os.replace(path, old_path)
+    try:
+        os.replace(tmp_path, path)
+    except OSError as e:
+        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+            raise
+        # Stored by another run in the meantime
+        shutil.rmtree(tmp_path)
+    finally:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def main(snapshot, refresh=False):
+    """Generates the map of waiting times predicted by the heatchmap model
+
+    The rasters of the model are cached until heatchmap is updated or a new map is published to its dataset, so the
+    rendering can be changed and rerun without recomputing them.
+
+    Args:
+        snapshot: The data of this run (unused)
+        refresh: Recompute the rasters even if they are cached
+    """
+    # The model and the plotting libraries take seconds to load, so they are only imported when the map is generated
+    import branca.colormap as cm
+    import folium
+    import matplotlib.colors as colors
+    import xyzservices.providers as xyz
+    from heatchmap.map_based_model import BOUNDARIES, BUCKETS
+
+    buckets = BUCKETS[:-1]
+    boundaries = BOUNDARIES[:-1]
+
+    outname = "hitchhiking.html"
+    template_path = os.path.join(DIRS["templates"], "index_template.html")
+
+    tiles = xyz.CartoDB.Positron
+    folium_map = folium.Map(
+        tiles=folium.TileLayer(no_wrap=True, tiles=tiles),
+        attr="Heatchmap",
+        min_zoom=1,
+        max_zoom=5,
     )
 
-    out.write(output)
-
-logger.info(f"Map saved to {outname}")
-logger.info("Done.")
+    cmap = colors.ListedColormap(buckets)
+
+    norm = colors.BoundaryNorm(boundaries, cmap.N, clip=True)
+    cmap.set_bad(color="#000000", alpha=0.0)  # opaque for NaN values (sea)
+
+    with stage("load raster") as s:
+        revision = get_map_revision()
+        # Offline, the rasters cached last are used
+        key = get_cache_key(revision) if revision is not None else None
+        rasters = None if refresh else load_rasters(key)
+        if rasters is None:
+            logger.info("Computing the rasters")
+            rasters = compute_rasters()
+            save_rasters(key or get_cache_key(None), rasters)
+        else:
+            logger.info(f"Using the cached rasters {key or 'of the last run'}")
+        s.rows_out = rasters["raw_raster"].size
+
+    with stage("build overlay"):
+        image = rasters["raw_raster"]
+        image = np.where(rasters["landmass_raster"], image, np.nan)
+        image = norm(image).data
+        # Apply the colormap to scalars
+        image_colors = cmap(image)
+
+        uncertainties = rasters["uncertainties"]
+        # no uncertainties for sea -> becomes fully transparent
+        uncertainties = np.where(rasters["landmass_raster"], uncertainties, uncertainties.max())
+        # Normalize uncertainties
+        uncertainties = (uncertainties - uncertainties.min()) / (uncertainties.max() - uncertainties.min())
+        uncertainties = 1 - uncertainties
+
+        # Combine RGB values with the opacity
+        rgba_array = np.empty_like(image_colors)
+        rgba_array[:, :, :3] = image_colors[:, :, :3]  # RGB
+        rgba_array[:, :, 3] = uncertainties
+
+        folium.raster_layers.ImageOverlay(
+            image=rgba_array,
+            bounds=[[-56, -180], [80, 180]],
+        ).add_to(folium_map)
+
+    legend = cm.LinearColormap(colors=buckets, index=boundaries[:-1], vmin=boundaries[0], vmax=boundaries[-1])
+    legend.caption = "Waiting time to catch a ride by hitchhiking (minutes)"
+    folium_map.add_child(legend)
+
+    with stage("write html"):
+        ### from show.py ###
+        folium_map.get_root().render()
+
+        header = folium_map.get_root().header.render()
+        header = header.replace(
+            '<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/css/bootstrap.min.css"/>',
+            '<link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.2.0/css/bootstrap.min.css">',
+        )
+        header = header.replace(
+            '<link rel="stylesheet" href="https://netdna.bootstrapcdn.com/bootstrap/3.0.0/css/bootstrap.min.css"/>',
+            '<link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.2.0/css/bootstrap-theme.min.css">',
+        )
+        body = folium_map.get_root().html.render()
+        script = folium_map.get_root().script.render()
+
+        with (
+            open(template_path, encoding="utf-8") as template,
+            open(os.path.join(DIRS["base"], "static", "map.js"), encoding="utf-8") as js,
+            open(os.path.join(DIRS["base"], "static", "style.css"), encoding="utf-8") as css,
+        ):
+            output = Template(template.read()).substitute(
+                {
+                    "folium_head": header,
+                    "folium_body": body,
+                    "folium_script": script,
+                    "hitch_script": js.read(),
+                    "hitch_style": css.read(),
+                }
+            )
+
+            write_dist_file(output, outname)
+
+    logger.info(f"Map saved to {outname}")
+    logger.info("Done.")
@@ -1,26 +1,36 @@
 import pandas as pd
 
-from hitch.helpers import get_db, get_dirs
+from hitch.helpers import get_dirs
+from hitch.writer import create_indexes
 
 dirs = get_dirs()
 
-################
-# ensure database columns are up to date
-points = pd.read_sql(
-    sql="select * from points",
-    con=get_db(),
-)
 
-points["user_id"] = pd.array([None] * len(points), dtype=pd.Int64Dtype())
+def main(snapshot):
+    """Brings the columns of the points table of old databases up to date
 
-if "from_hitchwiki" not in points.columns:
-    points["from_hitchwiki"] = points["name"].str.contains("(Hitchwiki)")
-    points["name"] = points["name"].str.replace(" (Hitchwiki)", "")
+    Args:
+        snapshot: The data of this run, only its connection is used
+    """
+    ################
+    # ensure database columns are up to date
+    points = pd.read_sql(
+        sql="select * from points",
+        con=snapshot.con,
+    )
 
-points.rename(columns={"name": "nickname"}, inplace=True)
+    points["user_id"] = pd.array([None] * len(points), dtype=pd.Int64Dtype())
 
-# no links for old anonymous reviews
-points.loc[points.nickname == "Anonymous", "nickname"] = None
+    if "from_hitchwiki" not in points.columns:
+        points["from_hitchwiki"] = points["name"].str.contains("(Hitchwiki)")
+        points["name"] = points["name"].str.replace(" (Hitchwiki)", "")
 
-points.to_sql("points", get_db(), index=False, if_exists="replace")
-################
+    points.rename(columns={"name": "nickname"}, inplace=True)
+
+    # no links for old anonymous reviews
+    points.loc[points.nickname == "Anonymous", "nickname"] = None
+
+    points.to_sql("points", snapshot.con, index=False, if_exists="replace")
+    # Replacing the table dropped its indexes
+    create_indexes(snapshot.con)
+    ################
@@ -1,115 +1,128 @@
 import html
 import logging
 import os
+import pickle
 
-import networkx
 import numpy as np
 import pandas as pd
 import simplejson
-
-from hitch.helpers import get_bearing, get_db, get_dirs, haversine_np
+from flask import current_app
+
+from hitch.deltas import record_version
+from hitch.dist import write_dist_file
+from hitch.duplicates import MAX_DISTANCE, fetch_reports, get_fingerprint, get_replace_map
+from hitch.geo import get_bearing, haversine_np
+from hitch.helpers import get_dirs, is_append
+from hitch.jobs import POINTS_QUERY
+from hitch.metrics import stage
+from hitch.places import format_cursor, write_place_index, write_recent_index
+from hitch.render_cache import RenderCache, hash_inputs
+from hitch.tiles import write_tiles
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 dirs = get_dirs()
 
-logger.info("Creating directories if they don't exist")
-os.makedirs(dirs["dist"], exist_ok=True)
-
-logger.info("Fetching points from database")
-points = pd.read_sql(
-    sql="select * from points where not banned order by datetime is not null desc, datetime desc",
-    con=get_db(),
-)
-
-points["user_id"] = points["user_id"].astype(pd.Int64Dtype())
+# Holds everything needed to patch the JSON files instead of regenerating them (see `run_incremental`)
+STATE_PATH = os.path.join(dirs["db"], "show-state.pickle")
+STATE_VERSION = 5
 
-logger.info("Fetching duplicates from database")
-duplicates = pd.read_sql("select * from duplicates where reviewed = accepted", get_db())
+# The last state written by this process as (mtime of the file, header, body), kept by `flask generate-daemon`
+warm_state = None
 
-try:
-    logger.info("Fetching users from database")
-    users = pd.read_sql("select * from user", get_db())
-except pd.errors.DatabaseError as err:
-    logger.error("Failed to fetch users from database")
-    raise Exception("Run server.py to create the user table") from err
+RECENT_LIMIT = 1000
 
-logger.info(f"{len(points)} points currently")
+# Newest reviews first, read backwards from the index on (banned, datetime) instead of sorting all reviews. Datetimes are
+# compared as text, which orders the formats of old and new reviews alike.
+RECENT_QUERY = (
+    "select rowid as point_rowid, * from points where banned = 0 and datetime is not null"
+    " order by datetime desc, rowid desc limit ?"
+)
 
-# merging and transforming data
-dup_rads = duplicates[["from_lon", "from_lat", "to_lon", "to_lat"]].values.T
+# Everything the HTML of a review depends on, bump RENDER_VERSION when changing `render_text`
+render_inputs = [
+    "id",
+    "comment",
+    "hitchhiker",
+    "rating",
+    "wait",
+    "signal",
+    "datetime",
+    "ride_datetime",
+    "lat",
+    "lon",
+    "dest_lat",
+    "dest_lon",
+]
+RENDER_VERSION = 1
 
-duplicates["distance"] = haversine_np(*dup_rads)
-duplicates["from"] = duplicates[["from_lat", "from_lon"]].apply(tuple, axis=1)
-duplicates["to"] = duplicates[["to_lat", "to_lon"]].apply(tuple, axis=1)
+point_columns = [
+    "lat",
+    "lon",
+    "rating",
+    "text",
+    "wait",
+    "distance",
+    "review_users",
+    "dest_lats",
+    "dest_lons",
+]
 
-duplicates = duplicates[duplicates.distance < 1.25]
+numeric_columns = ["rating", "wait", "lat", "lon", "dest_lat", "dest_lon"]
+
+place_files = {
+    "points.json": None,
+    "points_light.json": "light",
+    "points_with_destination.json": "with_destination",
+}
+
+# Layout of the points*.bin files, all little-endian: the version of the layout, the number of places, the version of the
+# places (see `hitch.deltas`) and a reserved 0 as uint32, then one array per column. Everything else is loaded per place
+# from /place/<id>.
+BINARY_VERSION = 2
+binary_columns = [
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("id", "<u4"),
+    ("wait", "<f4"),
+    ("distance", "<f4"),
+    ("rating", "u1"),
+    ("flags", "u1"),
+]
 
-dups = networkx.from_pandas_edgelist(duplicates, "from", "to")
-islands = networkx.connected_components(dups)
+# Bits of the flags column
+HAS_TEXT = 1
+HAS_DESTINATION = 2
+MANY_USERS = 4
 
-replace_map = {}
 
-logger.info("Processing duplicates")
-for island in islands:
-    parents = [node for node in island if node not in duplicates["from"].tolist()]
+def get_watermark(con):
+    """Returns a cheap summary of the tables this script depends on
 
-    if len(parents) == 1:
-        for node in island:
-            if node != parents[0]:
-                replace_map[node] = parents[0]
+    Used to detect whether anything changed since the last run and whether the change was a pure append.
+    """
+    return {
+        "points": con.execute("select coalesce(max(rowid), 0), count(*), coalesce(sum(banned), 0) from points").fetchone(),
+        "duplicates": get_fingerprint(fetch_reports(con)),
+        "users": con.execute("select coalesce(max(id), 0), count(*) from user").fetchone(),
+    }
 
-logger.info(f"Currently recorded duplicate spots are represented by: ${dups}")
 
-logger.info("Replacing duplicate points")
-points[["lat", "lon"]] = points[["lat", "lon"]].apply(lambda x: replace_map.get(tuple(x), x), axis=1, raw=True)
+def get_spots_query(n):
+    """Returns the query of all reviews of `n` spots, which are passed as lat, lon, lat, lon, ..."""
+    # A subquery instead of a plain list of values, only then SQLite uses the index on (lat, lon)
+    return POINTS_QUERY.format(f"and (lat, lon) in (select * from (values {', '.join(['(?, ?)'] * n)}))")
 
-points.loc[points.id.isin(range(1000000, 1040000)), "comment"] = (
-    points.loc[points.id.isin(range(1000000, 1040000)), "comment"]
-    .str.encode("cp1252", errors="ignore")
-    .str.decode("utf-8", errors="ignore")
-)
 
-points["datetime"] = pd.to_datetime(points.datetime)
-points["ride_datetime"] = pd.to_datetime(points.ride_datetime, errors="coerce")
-
-rads = points[["lon", "lat", "dest_lon", "dest_lat"]].values.T
-
-points["distance"] = haversine_np(*rads)
-points["direction"] = get_bearing(*rads)
-
-points.loc[(points.distance < 1), "dest_lat"] = None
-points.loc[(points.distance < 1), "dest_lon"] = None
-points.loc[(points.distance < 1), "direction"] = None
-points.loc[(points.distance < 1), "distance"] = None
-
-rounded_dir = 45 * np.round(points.direction / 45)
-points["arrows"] = rounded_dir.replace(
-    {
-        -90: "←",
-        90: "→",
-        0: "↑",
-        180: "↓",
-        -180: "↓",
-        -45: "↖",
-        45: "↗",
-        135: "↘",
-        -135: "↙",
-    }
-)
+def filter_duplicates(duplicates):
+    """Returns the duplicate reports listed on the map, with the distance between both spots"""
+    duplicates = duplicates[duplicates.reviewed == duplicates.accepted].copy()
 
-rating_text = "rating: " + points.rating.astype(int).astype(str) + "/5"
-destination_text = ", ride: " + np.round(points.distance).astype(str).str.replace(".0", "", regex=False) + " km " + points.arrows
+    dup_rads = duplicates[["from_lon", "from_lat", "to_lon", "to_lat"]].values.T
+    duplicates["distance"] = haversine_np(*dup_rads)
 
-points["wait_text"] = None
-has_accurate_wait = ~points.wait.isnull() & ~points.datetime.isnull()
-points.loc[has_accurate_wait, "wait_text"] = (
-    ", wait: "
-    + points.wait[has_accurate_wait].astype(int).astype(str)
-    + " min"
-    + (" " + points.signal[has_accurate_wait].replace({"ask": "💬", "ask-sign": "💬+🪧", "sign": "🪧", "thumb": "👍"})).fillna("")
-)
+    return duplicates[duplicates.distance < MAX_DISTANCE]
 
 
 def e(s):
@@ -118,56 +131,219 @@ def e(s):
     return s2
 
 
-points["extra_text"] = rating_text + points.wait_text.fillna("") + destination_text.fillna("")
+def prepare_points(points, users, replace_map, render_cache=None):
+    """Merges duplicates and derives all per review columns (distance, texts, hitchhiker) needed for the output
+
+    Works on any subset of the points table, as long as it contains all reviews of the spots it covers. Without a render
+    cache, the HTML of the reviews is not rendered.
+    """
+    points["user_id"] = points["user_id"].astype(pd.Int64Dtype())
+    # Columns that are NULL in every row (e.g. a few new reviews without destination) are read as objects
+    points[numeric_columns] = points[numeric_columns].astype(float)
+
+    logger.info("Replacing duplicate points")
+    with stage("merge duplicates", rows_in=len(points)):
+        points["lat"], points["lon"] = replace_map.apply(points.lat.to_numpy(), points.lon.to_numpy())
+
+    with stage("derive columns", rows_in=len(points)):
+        points = derive_columns(points, users)
+
+    if render_cache is None:
+        return points
+
+    # Rendering the HTML is the most expensive step, so it is only done for reviews whose inputs changed
+    with stage("render reviews", rows_in=len(points)) as s:
+        hashes = hash_inputs(points[render_inputs])
+        found, points["text"] = render_cache.lookup(points.point_rowid, hashes)
+        logger.info(f"Rendering {(~found).sum()} of {len(points)} reviews")
+        if not found.all():
+            points.loc[~found, "text"] = render_text(points[~found])
+            render_cache.store(points.point_rowid[~found], hashes[~found], points.text[~found].tolist())
+        # Counts the reviews that were actually rendered, all others came from the cache
+        s.rows_out = int((~found).sum())
+
+    return points
+
+
+def derive_columns(points, users):
+    """Adds the distance, direction, extra text and hitchhiker name of every review"""
+    points.loc[points.id.isin(range(1000000, 1040000)), "comment"] = (
+        points.loc[points.id.isin(range(1000000, 1040000)), "comment"]
+        .str.encode("cp1252", errors="ignore")
+        .str.decode("utf-8", errors="ignore")
+    )
+
+    points["datetime"] = pd.to_datetime(points.datetime)
+    points["ride_datetime"] = pd.to_datetime(points.ride_datetime, errors="coerce")
+
+    rads = points[["lon", "lat", "dest_lon", "dest_lat"]].values.T
+
+    points["distance"] = haversine_np(*rads)
+    points["direction"] = get_bearing(*rads)
+
+    points.loc[(points.distance < 1), "dest_lat"] = None
+    points.loc[(points.distance < 1), "dest_lon"] = None
+    points.loc[(points.distance < 1), "direction"] = None
+    points.loc[(points.distance < 1), "distance"] = None
+
+    rounded_dir = 45 * np.round(points.direction / 45)
+    points["arrows"] = rounded_dir.replace(
+        {
+            -90: "←",
+            90: "→",
+            0: "↑",
+            180: "↓",
+            -180: "↓",
+            -45: "↖",
+            45: "↗",
+            135: "↘",
+            -135: "↙",
+        }
+    )
+
+    rating_text = "rating: " + points.rating.astype(int).astype(str) + "/5"
+    destination_text = (
+        ", ride: " + np.round(points.distance).astype(str).str.replace(".0", "", regex=False) + " km " + points.arrows
+    )
+
+    points["wait_text"] = None
+    has_accurate_wait = ~points.wait.isnull() & ~points.datetime.isnull()
+    points.loc[has_accurate_wait, "wait_text"] = (
+        ", wait: "
+        + points.wait[has_accurate_wait].astype(int).astype(str)
+        + " min"
+        + (
+            " " + points.signal[has_accurate_wait].replace({"ask": "💬", "ask-sign": "💬+🪧", "sign": "🪧", "thumb": "👍"})
+        ).fillna("")
+    )
+
+    points["extra_text"] = rating_text + points.wait_text.fillna("") + destination_text.fillna("")
+
+    points["username"] = pd.merge(
+        left=points[["user_id"]],
+        right=users[["id", "username"]],
+        left_on="user_id",
+        right_on="id",
+        how="left",
+    )["username"].values
+    # Stays a text column even if no review of the batch has a name
+    points["hitchhiker"] = np.where(points.nickname.notna(), points.nickname, points.username).astype(object)
+
+    return points
+
+
+def render_text(points):
+    """Renders the HTML shown for every review"""
+    comment_nl = points["comment"] + "\n\n"
+
+    comment_nl.loc[(points.datetime.dt.year > 2021) & points.comment.isnull()] = ""
+
+    review_submit_datetime = points.datetime.dt.strftime(", %B %Y").fillna("")
+
+    user_link = ("<a href='/?user=" + e(points["hitchhiker"]) + "#filters'>" + e(points["hitchhiker"]) + "</a>").fillna(
+        "Anonymous"
+    )
+
+    text = (
+        e(comment_nl)
+        + "<i>"
+        + e(points["extra_text"])
+        + "</i><br><br>―"
+        + user_link
+        + points.ride_datetime.dt.strftime(", %a %d %b %Y, %H:%M").fillna(review_submit_datetime)
+    )
+
+    oldies = points.datetime.dt.year <= 2021
+    text.loc[oldies] = e(comment_nl[oldies]) + "―" + user_link[oldies] + points[oldies].datetime.dt.strftime(", %B %Y").fillna("")
+
+    return text
+
+
+def collect(points, column, func):
+    """Applies `func` to the list of values of every spot
 
-comment_nl = points["comment"] + "\n\n"
+    Args:
+        points: The points sorted by spot, so the values of every spot are contiguous
+        column: The column holding the values
+        func: Turns a list of values into the value of the spot
 
-comment_nl.loc[(points.datetime.dt.year > 2021) & points.comment.isnull()] = ""
+    Returns:
+        A Series indexed by (lat, lon), spots without any points are missing
+    """
+    lat, lon, values = points.lat.to_numpy(), points.lon.to_numpy(), points[column].tolist()
+    if len(values) == 0:
+        return pd.Series(dtype=object)
 
-review_submit_datetime = points.datetime.dt.strftime(", %B %Y").fillna("")
+    starts = np.flatnonzero(np.r_[True, (lat[1:] != lat[:-1]) | (lon[1:] != lon[:-1])])
+    ends = np.r_[starts[1:], len(values)]
+    return pd.Series(
+        [func(values[a:b]) for a, b in zip(starts, ends, strict=True)],
+        index=pd.MultiIndex.from_arrays([lat[starts], lon[starts]], names=["lat", "lon"]),
+        dtype=object,
+    )
 
-points["username"] = pd.merge(
-    left=points[["user_id"]],
-    right=users[["id", "username"]],
-    left_on="user_id",
-    right_on="id",
-    how="left",
-)["username"]
-points["hitchhiker"] = points["nickname"].fillna(points["username"])
 
-points["user_link"] = ("<a href='/?user=" + e(points["hitchhiker"]) + "#filters'>" + e(points["hitchhiker"]) + "</a>").fillna(
-    "Anonymous"
-)
+def build_places(points):
+    """Aggregates the reviews into one row per spot, indexed by (lat, lon)"""
+    groups = points.groupby(["lat", "lon"])
 
-points["text"] = (
-    e(comment_nl)
-    + "<i>"
-    + e(points["extra_text"])
-    + "</i><br><br>―"
-    + points["user_link"]
-    + points.ride_datetime.dt.strftime(", %a %d %b %Y, %H:%M").fillna(review_submit_datetime)
-)
+    places = groups[["country"]].first()
+    # Stays the same when reviews are added, as long as the first review of the spot is not banned or merged
+    places["id"] = groups.point_rowid.min()
+    places["rating"] = groups.rating.mean().round()
+    places["wait"] = points[~points.wait.isnull()].groupby(["lat", "lon"]).wait.mean()
+    places["distance"] = points[~points.distance.isnull()].groupby(["lat", "lon"]).distance.mean()
 
-oldies = points.datetime.dt.year <= 2021
-points.loc[oldies, "text"] = (
-    e(comment_nl[oldies]) + "―" + points.loc[oldies, "user_link"] + points[oldies].datetime.dt.strftime(", %B %Y").fillna("")
-)
+    # The list-like columns only join values, which is done on contiguous slices instead of a groupby apply per spot
+    points = points.iloc[np.argsort(groups.ngroup().to_numpy(), kind="stable")]
 
-groups = points.groupby(["lat", "lon"])
+    places["text"] = collect(points.dropna(subset=["text"]), "text", "<hr>".join)
+    places["text"] = places.text.fillna("")
 
-places = groups[["country"]].first()
-places["rating"] = groups.rating.mean().round()
-places["wait"] = points[~points.wait.isnull()].groupby(["lat", "lon"]).wait.mean()
-places["distance"] = points[~points.distance.isnull()].groupby(["lat", "lon"]).distance.mean()
-places["text"] = groups.text.apply(lambda t: "<hr>".join(t.dropna()))
+    places["review_users"] = collect(
+        points.dropna(subset=["text", "hitchhiker"]), "hitchhiker", lambda users: list(dict.fromkeys(users))
+    )
 
-places["review_users"] = points.dropna(subset=["text", "hitchhiker"]).groupby(["lat", "lon"]).hitchhiker.unique().apply(list)
+    places["dest_lats"] = collect(points.dropna(subset=["dest_lat", "dest_lon"]), "dest_lat", list)
+    places["dest_lons"] = collect(points.dropna(subset=["dest_lat", "dest_lon"]), "dest_lon", list)
 
-places["dest_lats"] = points.dropna(subset=["dest_lat", "dest_lon"]).groupby(["lat", "lon"]).dest_lat.apply(list)
-places["dest_lons"] = points.dropna(subset=["dest_lat", "dest_lon"]).groupby(["lat", "lon"]).dest_lon.apply(list)
+    places["light"] = (places.text.str.len() > 0) | ~places.distance.isnull()
+    places["with_destination"] = ~places.distance.isnull()
+    places["flags"] = (
+        HAS_TEXT * (places.text.str.len() > 0)
+        + HAS_DESTINATION * places.with_destination
+        + MANY_USERS * (places.review_users.str.len() > 2)
+    )
 
-places.reset_index(inplace=True)
-places.sort_values("rating", inplace=True, ascending=False)
+    # The records are serialized once here so that incremental runs only have to join them
+    places["json"] = [
+        simplejson.dumps(record, ignore_nan=True) for record in places.reset_index()[point_columns].to_dict(orient="records")
+    ]
+
+    return places[["id", "rating", "wait", "distance", "flags", "light", "with_destination", "json"]]
+
+
+def read_recent(con, users, replace_map):
+    """Reads the most recently submitted reviews, newest first, with their `cursor` (see `hitch.places.format_cursor`)"""
+    with stage("read recent") as s:
+        points = pd.read_sql(RECENT_QUERY, con, params=(RECENT_LIMIT,))
+        points["cursor"] = [format_cursor(*key) for key in zip(points.datetime, points.point_rowid, strict=True)]
+        s.rows_out = len(points)
+    return prepare_points(points, users, replace_map)
+
+
+def build_recent(points):
+    """Returns the entries of the recent feed
+
+    Args:
+        points: The reviews as returned by `read_recent`
+    """
+    recent = points.copy()
+    recent["url"] = "#" + recent.lat.astype(str) + "," + recent.lon.astype(str)
+    recent["text"] = recent.comment.fillna("") + " " + recent.extra_text.fillna("")
+    recent["hitchhiker"] = recent.hitchhiker.str.replace("://", "", regex=False)
+    recent["distance"] = recent["distance"].round(1)
+    return recent[["cursor", "url", "country", "datetime", "ride_datetime", "hitchhiker", "rating", "distance", "text"]]
 
 
 def write_json_file(data, filename):
@@ -177,45 +353,233 @@ def write_json_file(data, filename):
         data: The data to be converted to JSON
         filename: The filename to be stored into
     """
-    filepath = os.path.join(dirs["dist"], filename)
-    logger.info(f"Writing: {filepath}")
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(simplejson.dumps(data.to_dict(orient="records"), ignore_nan=True))
+    write_dist_file(simplejson.dumps(data.to_dict(orient="records"), ignore_nan=True), filename)
+
+
+def write_binary(places, filename, version):
+    """Writes the places as typed arrays that the map reads without parsing, see `binary_columns`"""
+    columns = {
+        "lat": places.index.get_level_values("lat"),
+        "lon": places.index.get_level_values("lon"),
+        "id": places.id,
+        "wait": places.wait,
+        "distance": places.distance,
+        "rating": places.rating.fillna(0),
+        "flags": places["flags"],
+    }
+    # 16 bytes, so the arrays of doubles are aligned
+    header = np.array([BINARY_VERSION, len(places), version, 0], dtype="<u4").tobytes()
+    arrays = [np.asarray(columns[name], dtype=dtype).tobytes() for name, dtype in binary_columns]
+    write_dist_file(header + b"".join(arrays), filename)
 
 
-point_columns = [
-    "lat",
-    "lon",
-    "rating",
-    "text",
-    "wait",
-    "distance",
-    "review_users",
-    "dest_lats",
-    "dest_lons",
-]
+def write_places(places):
+    """Writes all variations of the places JSON and binary files, the place index and the tiles
+
+    The differences to the places of the previous run are recorded first, so the files never claim a version whose
+    changes are not available.
+
+    Args:
+        places: The places as returned by `build_places`
+    """
+    places = places.sort_index().sort_values("rating", ascending=False, kind="stable")
+    version = record_version(places)
+    logger.info(f"Places are at version {version}")
+
+    for filename, variation in place_files.items():
+        selected = places if variation is None else places[places[variation]]
+        write_dist_file("[" + ", ".join(selected.json) + "]", filename)
+        write_binary(selected, filename.replace(".json", ".bin"), version)
+
+    write_place_index(places)
+
+    written = write_tiles(places)
+    logger.info(f"Wrote {written} changed tiles")
+
+
+def write_recent(recent):
+    """Writes the recent feed as points_recent.json and into the index /recent serves it from"""
+    recent = recent.copy()
+    recent["datetime"] = recent["datetime"].astype(str)
+    recent["datetime"] += np.where(~recent.ride_datetime.isnull(), " 🕒", "")
+    columns = ["cursor", "url", "country", "datetime", "hitchhiker", "rating", "distance", "text"]
+    records = [simplejson.dumps(record, ignore_nan=True) for record in recent[columns].to_dict(orient="records")]
+    write_dist_file("[" + ", ".join(records) + "]", "points_recent.json")
+    write_recent_index(recent.cursor.tolist(), records)
+
+
+def write_duplicates(duplicates):
+    duplicates["from_url"] = "#" + duplicates.from_lat.astype(str) + "," + duplicates.from_lon.astype(str)
+    duplicates["to_url"] = "#" + duplicates.to_lat.astype(str) + "," + duplicates.to_lon.astype(str)
+    write_json_file(duplicates[["id", "from_url", "to_url", "distance", "reviewed", "accepted"]], "points_duplicates.json")
+
+
+def is_usable(header):
+    """Whether the state was written by this version for the same database and its files still exist"""
+    return (
+        header["version"] == STATE_VERSION
+        and header["database"] == current_app.config["DATABASE_URI"]
+        and all(os.path.exists(os.path.join(dirs["dist"], filename)) for filename in place_files)
+    )
+
 
-logger.info("Generating JSON data files")
-write_json_file(places[point_columns], "points.json")
+def load_state(watermark):
+    """Returns the state of the previous run, or None if there is no usable state
 
-places_light = places[(places.text.str.len() > 0) | ~places.distance.isnull()]
-write_json_file(places_light[point_columns], "points_light.json")
+    The header (version, database and watermark) is pickled separately, so the rest is only loaded if something changed.
+    If this process wrote the state file itself, the state is taken from memory instead.
+    """
+    if not os.path.exists(STATE_PATH):
+        return None
+
+    if warm_state is not None and warm_state[0] == os.stat(STATE_PATH).st_mtime_ns:
+        _, header, body = warm_state
+        if not is_usable(header):
+            return None
+        # A copy, so a run failing halfway does not leave a half patched body behind
+        return dict(header, body=None if header["watermark"] == watermark else dict(body))
+
+    with open(STATE_PATH, "rb") as f:
+        state = pickle.load(f)
+        if not is_usable(state):
+            return None
+
+        state["body"] = None if state["watermark"] == watermark else pickle.load(f)
+
+    return state
+
+
+def save_state(watermark, body):
+    global warm_state
+    header = {"version": STATE_VERSION, "database": current_app.config["DATABASE_URI"], "watermark": watermark}
+
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(body, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, STATE_PATH)
+
+    warm_state = (os.stat(STATE_PATH).st_mtime_ns, header, body)
+
+
+def run_full(snapshot, watermark):
+    logger.info("Fetching points from database")
+    points = snapshot.points.copy()
+    duplicates = filter_duplicates(snapshot.duplicates)
+
+    with stage("build replace map") as s:
+        replace_map = get_replace_map(snapshot.con)
+        s.rows_out = len(replace_map)
 
-places_with_destination = places[~places.distance.isnull()]
-write_json_file(places_with_destination[point_columns], "points_with_destination.json")
+    logger.info(f"{len(points)} points currently")
+    with RenderCache(RENDER_VERSION) as render_cache:
+        points = prepare_points(points, snapshot.users, replace_map, render_cache)
+        render_cache.prune(points.point_rowid)
+
+    with stage("build places", rows_in=len(points)) as s:
+        places = build_places(points)
+        s.rows_out = len(places)
+
+    recent = build_recent(read_recent(snapshot.con, snapshot.users, replace_map))
+
+    logger.info("Generating JSON data files")
+    with stage("write json", rows_in=len(places)):
+        write_places(places)
+        write_recent(recent)
+        write_duplicates(duplicates)
+
+    with stage("save state"):
+        save_state(watermark, {"replace_map": replace_map, "places": places})
+
+
+def run_incremental(snapshot, watermark, state):
+    """Patches the output of the previous run with the reviews submitted since then
+
+    Only the spots that received new reviews are recomputed. Falls back to a full run for anything other than appended
+    reviews and new users (e.g. bans or new duplicate reports). Edits that do not change the row counts are only picked
+    up by the next full run.
+    """
+    con = snapshot.con
+    old = state["watermark"]
+
+    if watermark == old:
+        logger.info("Nothing changed since the last run")
+        return
+
+    if (
+        watermark["duplicates"] != old["duplicates"]
+        or not is_append(con, old["points"], watermark["points"], "points", ["banned"])
+        or not is_append(con, old["users"], watermark["users"], "user", [])
+    ):
+        logger.info("Changes are not append-only, falling back to a full run")
+        return run_full(snapshot, watermark)
+
+    body = state["body"]
+    replace_map = body["replace_map"]
+
+    logger.info("Fetching new points from database")
+    with stage("read new points") as s:
+        new_points = pd.read_sql(sql=POINTS_QUERY.format("and rowid > ?"), con=con, params=(old["points"][0],))
+        s.rows_out = len(new_points)
+    logger.info(f"{len(new_points)} new points")
+
+    if len(new_points) > 0:
+        users = snapshot.users
+        with RenderCache(RENDER_VERSION) as render_cache:
+            new_points = prepare_points(new_points, users, replace_map, render_cache)
+
+            # Every review of a touched spot is needed, including those of the spots merged into it
+            touched = set(zip(new_points.lat, new_points.lon, strict=True))
+            coords = list(touched) + replace_map.sources(touched)
+
+            logger.info(f"Fetching points of {len(touched)} touched spots")
+            with stage("read touched spots", rows_in=len(touched)) as s:
+                chunks = [coords[i : i + 400] for i in range(0, len(coords), 400)]
+                points = pd.concat(
+                    [
+                        pd.read_sql(
+                            sql=get_spots_query(len(chunk)),
+                            con=con,
+                            params=[c for coord in chunk for c in coord],
+                        )
+                        for chunk in chunks
+                    ]
+                ).sort_values("datetime", ascending=False, na_position="last", kind="stable")
+                s.rows_out = len(points)
+            points = prepare_points(points.reset_index(drop=True), users, replace_map, render_cache)
+
+        with stage("patch places", rows_in=len(points)) as s:
+            places = body["places"]
+            body["places"] = pd.concat([places.drop(index=list(touched), errors="ignore"), build_places(points)])
+            s.rows_out = len(body["places"])
+
+        recent = build_recent(read_recent(con, users, replace_map))
+
+        logger.info("Patching JSON data files")
+        with stage("write json", rows_in=len(body["places"])):
+            write_places(body["places"])
+            write_recent(recent)
+
+    with stage("save state"):
+        save_state(watermark, body)
+
+
+def main(snapshot, incremental=False):
+    """Generates the JSON files of the map
+
+    Args:
+        snapshot: The data of this run (see `hitch.jobs.Snapshot`)
+        incremental: Patch the files of the previous run with the reviews submitted since then, if possible
+    """
+    logger.info("Creating directories if they don't exist")
+    os.makedirs(dirs["dist"], exist_ok=True)
 
-recent = points.dropna(subset=["datetime"]).sort_values("datetime", ascending=False).iloc[:1000]
-recent["url"] = "#" + recent.lat.astype(str) + "," + recent.lon.astype(str)
-recent["text"] = points.comment.fillna("") + " " + points.extra_text.fillna("")
-recent["hitchhiker"] = recent.hitchhiker.str.replace("://", "", regex=False)
-recent["distance"] = recent["distance"].round(1)
-recent["datetime"] = recent["datetime"].astype(str)
-recent["datetime"] += np.where(~recent.ride_datetime.isnull(), " 🕒", "")
-write_json_file(recent[["url", "country", "datetime", "hitchhiker", "rating", "distance", "text"]], "points_recent.json")
+    watermark = get_watermark(snapshot.con)
+    state = load_state(watermark) if incremental else None
 
-duplicates["from_url"] = "#" + duplicates.from_lat.astype(str) + "," + duplicates.from_lon.astype(str)
-duplicates["to_url"] = "#" + duplicates.to_lat.astype(str) + "," + duplicates.to_lon.astype(str)
-duplicates_data = duplicates[["id", "from_url", "to_url", "distance", "reviewed", "accepted"]].to_dict(orient="records")
-write_json_file(duplicates[["id", "from_url", "to_url", "distance", "reviewed", "accepted"]], "points_duplicates.json")
+    if state is None:
+        run_full(snapshot, watermark)
+    else:
+        run_incremental(snapshot, watermark, state)
 
-logger.info("Script execution completed")
+    logger.info("Script execution completed")
@@ -0,0 +1,23 @@
+from hitch.metrics import stage
+from hitch.user_stats import compute_user_stats, write_user_stats
+
+
+def main(snapshot):
+    """Rebuilds the stats of every registered user shown on their account page
+
+    New reviews are added to the stats as they are submitted, this picks up everything else, e.g. bans and old reviews
+    attributed by nickname.
+
+    Args:
+        snapshot: The data of this run (see `hitch.jobs.Snapshot`)
+    """
+    points = snapshot.columns(
+        ["point_rowid", "nickname", "user_id", "wait", "country", "datetime", "lat", "lon", "dest_lat", "dest_lon"]
+    )
+
+    with stage("compute", rows_in=len(points)) as s:
+        stats = compute_user_stats(points, snapshot.users)
+        s.rows_out = len(stats)
+
+    with stage("write", rows_in=len(stats)) as s:
+        s.rows_out = write_user_stats(snapshot.con, stats, int(points.point_rowid.max()) if len(points) else 0)
@@ -45,10 +45,21 @@ class BaseConfig:
     DATABASE_NAME = os.getenv("DATABASE_NAME", "points.sqlite")
     DATABASE_URI = os.getenv("DATABASE_URI", os.path.join(baseDir, "db", DATABASE_NAME))
 
+    # Milliseconds to wait for locks held by other connections, e.g. a generator script
+    DATABASE_BUSY_TIMEOUT = 5000
+
+    # Commits bursts of submissions in one transaction, waiting up to the delay (seconds) for more writes
+    WRITE_GROUP_COMMIT = os.getenv("WRITE_GROUP_COMMIT", "false").lower() == "true"
+    WRITE_GROUP_COMMIT_DELAY = 0.01
+
     SQLALCHEMY_DATABASE_URI = sql_prefix + DATABASE_URI
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {"pool_pre_ping": True}
 
+    # Countries are looked up locally, Nominatim is only asked if that fails (see hitch/geocoder.py)
+    NOMINATIM_FALLBACK = os.getenv("NOMINATIM_FALLBACK", "true").lower() == "true"
+    NOMINATIM_TIMEOUT = 3
+
     # Flask-Mailman configuration
     MAIL_SERVER = os.getenv("MAIL_SERVER", "mail.smtp2go.com")
     MAIL_PORT = os.getenv("MAIL_PORT", 587)  # or 2525 if required
@@ -0,0 +1,144 @@
+import math
+import os
+import threading
+
+import numpy as np
+import simplejson
+
+# Size of the grid cells (in degrees) the places are bucketed into
+CELL_SIZE = 1.0
+ROWS = math.ceil(180 / CELL_SIZE)
+COLS = math.ceil(360 / CELL_SIZE)
+
+# Below this zoom level places are aggregated into clusters, same as `disableClusteringAtZoom` in map.js
+CLUSTER_MAX_ZOOM = 7
+# Approximate radius of a cluster on screen in pixels, same as the default `maxClusterRadius` of Leaflet.markercluster
+CLUSTER_RADIUS = 80
+
+
+def cell_keys(lat, lon, cell_size):
+    """Returns the key of the grid cell every coordinate falls into, keys increase by longitude first"""
+    rows, cols = math.ceil(180 / cell_size), math.ceil(360 / cell_size)
+    row = np.clip(np.floor((lat + 90) / cell_size), 0, rows - 1).astype(np.int64)
+    col = np.clip(np.floor((lon + 180) / cell_size), 0, cols - 1).astype(np.int64)
+    return row * cols + col
+
+
+def split_bbox(west, south, east, north):
+    """Normalizes a bounding box as sent by Leaflet into boxes that do not cross the antimeridian"""
+    south, north = max(south, -90), min(north, 90)
+    width = east - west
+    if width >= 360:
+        return [(-180, south, 180, north)]
+
+    west = (west + 180) % 360 - 180
+    east = west + width
+    if east > 180:
+        return [(west, south, 180, north), (-180, south, east - 360, north)]
+    return [(west, south, east, north)]
+
+
+def aggregate(lat, lon, rating, cell_size):
+    """Groups places into grid cells of the given size
+
+    Returns:
+        For every non-empty cell: the indices of its first place, the number of places, the centroid and mean rating
+    """
+    keys = cell_keys(lat, lon, cell_size)
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    return (
+        first,
+        counts,
+        np.bincount(inverse, weights=lat) / counts,
+        np.bincount(inverse, weights=lon) / counts,
+        np.bincount(inverse, weights=rating) / counts,
+    )
+
+
+class PlaceIndex:
+    """Grid index over the places written by the show script
+
+    The places are sorted by their cell key, so all places of a row of cells within a longitude range are a
+    contiguous slice that can be found by binary search.
+    """
+
+    def __init__(self, places, generation=None):
+        self.generation = generation
+        self.places = places
+
+        lat = np.array([p["lat"] for p in places], dtype=np.float64)
+        lon = np.array([p["lon"] for p in places], dtype=np.float64)
+        keys = cell_keys(lat, lon, CELL_SIZE)
+
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.lat = lat[self.order]
+        self.lon = lon[self.order]
+        self.rating = np.array([p["rating"] for p in places], dtype=np.float64)[self.order]
+
+    @classmethod
+    def from_file(cls, path):
+        generation = get_generation(path)
+        with open(path, encoding="utf-8") as f:
+            return cls(simplejson.load(f), generation=generation)
+
+    def query(self, west, south, east, north):
+        """Returns the positions (into the sorted arrays) of all places within the bounding box"""
+        selected = []
+        for w, s, e, n in split_bbox(west, south, east, north):
+            first_row, last_row = (int(np.clip((v + 90) // CELL_SIZE, 0, ROWS - 1)) for v in (s, n))
+            first_col, last_col = (int(np.clip((v + 180) // CELL_SIZE, 0, COLS - 1)) for v in (w, e))
+
+            rows = np.arange(first_row, last_row + 1) * COLS
+            starts = np.searchsorted(self.keys, rows + first_col, side="left")
+            ends = np.searchsorted(self.keys, rows + last_col, side="right")
+            candidates = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends, strict=True)])
+
+            lat, lon = self.lat[candidates], self.lon[candidates]
+            selected.append(candidates[(lat >= s) & (lat <= n) & (lon >= w) & (lon <= e)])
+
+        return np.unique(np.concatenate(selected))
+
+    def places_at(self, positions):
+        return [self.places[i] for i in self.order[positions]]
+
+    def lookup(self, west, south, east, north, zoom):
+        """Returns the places within the bounding box, aggregated into clusters below `CLUSTER_MAX_ZOOM`
+
+        Clusters that only contain a single place are returned as that place.
+        """
+        positions = self.query(west, south, east, north)
+        if zoom >= CLUSTER_MAX_ZOOM:
+            return self.places_at(positions), []
+
+        cell_size = 360 * CLUSTER_RADIUS / (256 * 2**zoom)
+        first, counts, lat, lon, rating = aggregate(self.lat[positions], self.lon[positions], self.rating[positions], cell_size)
+        single = counts == 1
+        clusters = [
+            {"lat": la, "lon": lo, "count": int(c), "rating": round(r, 1)}
+            for la, lo, c, r in zip(lat[~single], lon[~single], counts[~single], rating[~single], strict=True)
+        ]
+        return self.places_at(positions[first[single]]), clusters
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_generation(path):
+    """Identifies the version of a file in dist, which the generator scripts replace atomically"""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def get_index(path):
+    """Returns the index for the given places file, loading it once per process and again whenever the file is replaced"""
+    generation = get_generation(path)
+
+    index = _indexes.get(path)
+    if index is None or index.generation != generation:
+        with _lock:
+            index = _indexes.get(path)
+            if index is None or index.generation != generation:
+                index = _indexes[path] = PlaceIndex.from_file(path)
+    return index
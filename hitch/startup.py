@@ -0,0 +1,46 @@
+import subprocess
+import sys
+import time
+
+from hitch.helpers import get_dirs
+
+# Libraries only the generator scripts need, loading them slows down every worker and every flask command
+HEAVY_MODULES = ["pandas", "numpy", "shapely", "matplotlib", "folium", "plotly", "heatchmap", "requests", "scipy", "sklearn"]
+
+APP_CODE = "from hitch import create_app; create_app()"
+
+
+def profile_imports(code=APP_CODE):
+    """Runs the code in a fresh interpreter and reports what it imported
+
+    Returns:
+        Wall time of the interpreter in seconds, and (module, self microseconds, cumulative microseconds) of every
+        imported module in import order
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, cwd=get_dirs()["root"], check=True
+    )
+    seconds = time.perf_counter() - start
+
+    modules = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return seconds, modules
+
+
+def format_profile(seconds, modules, top=20):
+    """Returns a report of the slowest imports and the heavy libraries that were loaded"""
+    heavy = [name for name, _, _ in modules if name in HEAVY_MODULES]
+    total = sum(own for _, own, _ in modules)
+
+    lines = [f"Started in {seconds:.2f}s, {len(modules)} modules imported in {total / 1e6:.2f}s", ""]
+    lines.append(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for name, own, cumulative in sorted(modules, key=lambda m: -m[2])[:top]:
+        lines.append(f"{cumulative / 1000:>14.1f}{own / 1000:>10.1f}  {name}")
+    lines.append("")
+    lines.append(f"Heavy libraries: {', '.join(heavy) if heavy else 'none'}")
+    return "\n".join(lines)
@@ -42,65 +42,40 @@ async function initializeMap() {
   });
 }
 
-// Load markers from JSON data
-async function loadMarkers(map) {
-  // If the template warrants a variation, load that variation, otherwise all points
-  const url =
-    typeof MAP_VARIATION !== "undefined"
-      ? `/points_${MAP_VARIATION}.json`
-      : `/points.json`;
-
-  return fetch(url)
-    .then((response) => response.json())
-    .then((data) => {
-      var markerCluster = L.markerClusterGroup({
+// Load markers from the binary places file, their texts are loaded when needed
+async function loadMarkers(map, options = {}) {
+  if (typeof MAP_VARIATION !== "undefined" && MAP_VARIATION === "tiles")
+    return loadTiles(map);
+
+  return fetch(`${placesUrl()}.bin`, options)
+    .then((response) => response.arrayBuffer())
+    .then((buffer) => {
+      markerCluster = L.markerClusterGroup({
         disableClusteringAtZoom: 7,
         spiderfyOnMaxZoom: false,
       });
 
-      data.forEach((m) => {
-        var color = {
-          1: "red",
-          2: "orange",
-          3: "yellow",
-          4: "lightgreen",
-          5: "lightgreen",
-        }[m.rating];
-        var opacity = { 1: 0.3, 2: 0.4, 3: 0.6, 4: 0.8, 5: 0.8 }[m.rating];
-        var coords = new L.latLng(m.lat, m.lon);
-
-        var marker = L.circleMarker(coords, {
-          radius: 5,
-          weight: 1 + (m.review_users?.length > 2),
-          fillOpacity: opacity,
-          color: "black",
-          fillColor: color,
-          _row:
-            Object.prototype.toString.call(m) === "[object Array]"
-              ? m
-              : [
-                  m.lat,
-                  m.lon,
-                  m.rating,
-                  m.text,
-                  m.wait,
-                  m.distance,
-                  m.review_users,
-                  m.dest_lats,
-                  m.dest_lons,
-                ],
-        });
-
-        marker.on("click", (e) => handleMarkerClick(marker, coords, e));
-        if (m.review_users?.length >= 3)
-          marker.on("add", (_) => setTimeout((_) => marker.bringToFront(), 0));
-        if (m.dest_lats?.length) destinationMarkers.push(marker);
-
-        marker.addTo(markerCluster);
-        allMarkers.push(marker);
-      });
+      let places = decodePlaces(buffer);
+      placesVersion = places.version;
+      for (let i = 0; i < places.id.length; i++) {
+        createMarker({
+          id: places.id[i],
+          lat: places.lat[i],
+          lon: places.lon[i],
+          rating: places.rating[i],
+          wait: places.wait[i],
+          distance: places.distance[i],
+          flags: places.flags[i],
+        }).addTo(markerCluster);
+      }
 
       markerCluster.addTo(map);
+      if (!syncTimer) {
+        syncTimer = setInterval(syncPlaces, SYNC_INTERVAL);
+        document.addEventListener("visibilitychange", syncPlaces);
+      }
+      // The service worker may have answered with an older version of the file
+      return syncPlaces();
     })
     .catch((error) => {
       console.error("Error loading markers:", error);
@@ -108,6 +83,233 @@ async function loadMarkers(map) {
     });
 }
 
+// Applies the places added, changed and removed since the loaded version, see hitch/deltas.py
+const SYNC_INTERVAL = 60 * 1000;
+var markerCluster = null,
+  placesVersion = null,
+  syncTimer = null;
+
+async function syncPlaces() {
+  if (placesVersion === null || document.hidden) return;
+
+  let delta;
+  try {
+    delta = await (await fetch(`/api/delta?since=${placesVersion}`)).json();
+  } catch (error) {
+    // Offline, the places are synced again later
+    return;
+  }
+  if (delta.version === placesVersion) return;
+
+  if (delta.reset) {
+    // Too old to catch up, all places are loaded again
+    map.removeLayer(markerCluster);
+    allMarkers = [];
+    destinationMarkers = [];
+    allDetails = null;
+    return loadMarkers(map, { cache: "reload" });
+  }
+
+  let outdated = new Set(
+    [...Object.keys(delta.changed), ...delta.removed].map(Number)
+  );
+  let removed = allMarkers.filter((m) => outdated.has(m.options._id));
+  markerCluster.removeLayers(removed);
+  allMarkers = allMarkers.filter((m) => !outdated.has(m.options._id));
+  destinationMarkers = destinationMarkers.filter(
+    (m) => !outdated.has(m.options._id)
+  );
+
+  let places = Object.entries({ ...delta.added, ...delta.changed });
+  markerCluster.addLayers(
+    places
+      .filter(([_, place]) => inVariation(place))
+      .map(([id, place]) => createMarker({ ...place, id: +id }))
+  );
+  placesVersion = delta.version;
+}
+
+// Whether a place belongs to the variation of the map, the same way as in hitch/scripts/show.py
+function inVariation(place) {
+  if (typeof MAP_VARIATION === "undefined") return true;
+  if (MAP_VARIATION === "light") return !!place.text || place.distance != null;
+  if (MAP_VARIATION === "with_destination") return place.distance != null;
+  return true;
+}
+
+// If the template warrants a variation, load that variation, otherwise all points
+function placesUrl() {
+  return typeof MAP_VARIATION !== "undefined"
+    ? `/points_${MAP_VARIATION}`
+    : `/points`;
+}
+
+// Columns of the binary places file as written by hitch/scripts/show.py
+const PLACE_COLUMNS = [
+  ["lat", Float64Array],
+  ["lon", Float64Array],
+  ["id", Uint32Array],
+  ["wait", Float32Array],
+  ["distance", Float32Array],
+  ["rating", Uint8Array],
+  ["flags", Uint8Array],
+];
+const HAS_DESTINATION = 2,
+  MANY_USERS = 4;
+
+function decodePlaces(buffer) {
+  let [format, count, version] = new Uint32Array(buffer, 0, 4);
+  if (format !== 2) throw new Error(`Unknown format ${format} of places`);
+
+  let places = { version: version },
+    offset = 16;
+  for (let [name, type] of PLACE_COLUMNS) {
+    places[name] = new type(buffer, offset, count);
+    offset += count * type.BYTES_PER_ELEMENT;
+  }
+  return places;
+}
+
+// Fills in text, users and destinations of a marker loaded from the binary file
+async function loadPlace(marker) {
+  let response = await fetch(`/place/${marker.options._id}`);
+  if (!response.ok)
+    throw new Error(`Place ${marker.options._id}: ${response.status}`);
+  fillRow(marker.options._row, await response.json());
+}
+
+function fillRow(row, place) {
+  row[3] = place.text ?? "";
+  row[6] = place.review_users;
+  row[7] = place.dest_lats;
+  row[8] = place.dest_lons;
+}
+
+// Loads text, users and destinations of all markers at once, for filtering and exporting
+var allDetails = null;
+function loadAllDetails() {
+  allDetails =
+    allDetails ||
+    fetch(`${placesUrl()}.json`)
+      .then((response) => response.json())
+      .then((data) => {
+        let places = new Map(data.map((p) => [`${p.lat},${p.lon}`, p]));
+        for (let marker of allMarkers) {
+          let row = marker.options._row,
+            place = places.get(`${row[0]},${row[1]}`);
+          if (place && row[3] === undefined) fillRow(row, place);
+        }
+      })
+      .catch((error) => {
+        allDetails = null;
+        throw error;
+      });
+  return allDetails;
+}
+
+var ratingColors = {
+  1: "red",
+  2: "orange",
+  3: "yellow",
+  4: "lightgreen",
+  5: "lightgreen",
+};
+
+function createMarker(m) {
+  var opacity = { 1: 0.3, 2: 0.4, 3: 0.6, 4: 0.8, 5: 0.8 }[m.rating];
+  var coords = new L.latLng(m.lat, m.lon);
+
+  var marker = L.circleMarker(coords, {
+    radius: 5,
+    weight: 1 + (m.review_users?.length > 2 || (m.flags & MANY_USERS) > 0),
+    fillOpacity: opacity,
+    color: "black",
+    fillColor: ratingColors[m.rating],
+    _id: m.id,
+    _row:
+      Object.prototype.toString.call(m) === "[object Array]"
+        ? m
+        : [
+            m.lat,
+            m.lon,
+            m.rating,
+            m.text,
+            m.wait,
+            m.distance,
+            m.review_users,
+            m.dest_lats,
+            m.dest_lons,
+          ],
+  });
+
+  marker.on("click", (e) => handleMarkerClick(marker, coords, e));
+  if (m.review_users?.length >= 3 || m.flags & MANY_USERS)
+    marker.on("add", (_) => setTimeout((_) => marker.bringToFront(), 0));
+  if (m.dest_lats?.length || m.flags & HAS_DESTINATION)
+    destinationMarkers.push(marker);
+
+  allMarkers.push(marker);
+  return marker;
+}
+
+// Load only the tiles of the visible area (see hitch/tiles.py), clusters below this zoom and places from it on
+const TILE_PLACES_ZOOM = 7;
+
+function loadTiles(map) {
+  var tiles = {},
+    visible = L.layerGroup().addTo(map),
+    view = 0;
+
+  function tileLayer(tile) {
+    var layer = L.layerGroup();
+    for (let [lat, lon, count, rating, wait] of tile.clusters || []) {
+      L.circleMarker([lat, lon], {
+        radius: 6 + 3 * Math.log10(count),
+        weight: 1,
+        color: "black",
+        fillOpacity: 0.7,
+        fillColor: ratingColors[Math.round(rating)],
+      })
+        .bindTooltip(
+          `${count} spots, rating ${rating}/5` +
+            (wait === null ? "" : `, waiting time ${wait} min`)
+        )
+        .on("click", (e) => map.setView(e.latlng, map.getZoom() + 2))
+        .addTo(layer);
+    }
+    for (let place of tile.places || []) createMarker(place).addTo(layer);
+    return layer;
+  }
+
+  function update() {
+    let z = Math.max(0, Math.min(Math.floor(map.getZoom()), TILE_PLACES_ZOOM)),
+      n = 2 ** z,
+      bounds = map.getBounds(),
+      nw = map.project(bounds.getNorthWest(), z).divideBy(256).floor(),
+      se = map.project(bounds.getSouthEast(), z).divideBy(256).floor(),
+      current = ++view;
+
+    visible.clearLayers();
+    for (let x = nw.x; x <= se.x && x < nw.x + n; x++) {
+      for (let y = Math.max(nw.y, 0); y <= Math.min(se.y, n - 1); y++) {
+        let key = `${z}/${((x % n) + n) % n}/${y}`;
+        // Empty tiles do not exist, those are remembered as null
+        tiles[key] =
+          tiles[key] ||
+          fetch(`/tiles/${key}.json`)
+            .then((response) => (response.ok ? response.json() : null))
+            .then((tile) => tile && tileLayer(tile));
+        tiles[key].then((layer) => {
+          if (layer && current === view) visible.addLayer(layer);
+        });
+      }
+    }
+  }
+
+  map.on("moveend", update);
+  update();
+}
+
 // Initialize the map and set up event listeners
 (async () => {
   map = await initializeMap();
@@ -356,6 +558,17 @@ function handleMarkerClick(marker, point, e) {
 
 function markerClick(marker) {
   var row = marker.options._row;
+  if (row[3] === undefined) {
+    loadPlace(marker)
+      .then(() => {
+        if (row[3] !== undefined) markerClick(marker);
+      })
+      .catch((error) => {
+        console.error("Error loading place:", error);
+        alert("This spot could not be loaded, please try again.");
+      });
+    return;
+  }
   active = [marker];
 
   addSpotPoints = [];
@@ -617,14 +830,16 @@ function storageAvailable(type) {
   }
 }
 
-function exportAsGPX() {
+async function exportAsGPX() {
+  await loadAllDetails();
   var script = document.createElement("script");
   script.src = "https://cdn.jsdelivr.net/npm/togpx@0.5.4/togpx.js";
   script.onload = function () {
     let features = allMarkers.map((m) => ({
       type: "Feature",
       properties: {
-        text: summaryText(m.options._row) + "\n\n" + m.options._row[3],
+        text:
+          summaryText(m.options._row) + "\n\n" + (m.options._row[3] ?? ""),
         url: `https://hitchmap.com/${m.options._row[0]},${m.options._row[1]}`,
       },
       geometry: {
@@ -724,7 +939,7 @@ function updateConeSpread() {
   if (spread > 0) setQueryParameter("spread", spread);
 }
 
-function applyParams() {
+function applyParams(detailsLoaded = false) {
   const normalizedAngle = parseFloat(getQueryParameter("direction"));
   const spread = parseFloat(getQueryParameter("spread")) || 70;
 
@@ -758,6 +973,18 @@ function applyParams() {
     userFilter.value ||
     distanceFilter.value
   ) {
+    // Loaded once, places missing from the JSON file (e.g. merged since the
+    // binary file was cached) are filtered without their details
+    if (
+      detailsLoaded !== true &&
+      allMarkers.some((marker) => marker.options._row[3] === undefined)
+    ) {
+      loadAllDetails()
+        .then(() => applyParams(true))
+        .catch((error) => console.error("Error loading details:", error));
+      return;
+    }
+
     if (filterMarkerGroup) filterMarkerGroup.remove();
     if (filterDestLineGroup) filterDestLineGroup.remove();
 
@@ -779,7 +1006,9 @@ function applyParams() {
     }
     if (textFilter.value) {
       filterMarkers = filterMarkers.filter((x) =>
-        x.options._row[3].toLowerCase().includes(textFilter.value.toLowerCase())
+        (x.options._row[3] || "")
+          .toLowerCase()
+          .includes(textFilter.value.toLowerCase())
       );
     }
     if (distanceFilter.value) {
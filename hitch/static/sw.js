@@ -124,15 +124,47 @@ async function handleTileRequest(request, match) {
     }
 }
 
+// The places files are served from the cache for up to a day, the map catches up with /api/delta
+const PLACES_REGEXP = /\/points[\w-]*\.bin$/
+const PLACES_MAX_AGE = 24 * 60 * 60 * 1000
+const FETCHED_HEADER = 'x-hitchmap-fetched'
+
+async function handlePlacesRequest(request) {
+    let cache = await caches.open(cacheName)
+    let cached = await cache.match(request.url)
+    // The map asks for a reload when it is too far behind
+    if (cached && request.cache !== 'reload' && Date.now() - cached.headers.get(FETCHED_HEADER) < PLACES_MAX_AGE)
+        return cached
+
+    try {
+        let response = await fetch(request.url, {cache: request.cache === 'reload' ? 'reload' : 'default'})
+        if (!response.ok) throw new Error('No 200')
+
+        const headers = new Headers(response.headers)
+        headers.set(FETCHED_HEADER, Date.now())
+        let body = await response.arrayBuffer()
+        await cache.put(request.url, new Response(body, {headers: headers}))
+        return new Response(body, {headers: headers})
+    }
+    catch (e) {
+        if (cached) return cached
+        throw e
+    }
+}
+
 self.addEventListener('fetch', (event) => {
     if (event.request.method != 'GET')
         return
 
     let match = REGEXP.exec(event.request.url)
+    let url = new URL(event.request.url)
 
     if (event.request.destination === 'image' && match) {
         event.respondWith(handleTileRequest(event.request, match))
     }
+    else if (url.hostname === self.location.hostname && PLACES_REGEXP.test(url.pathname)) {
+        event.respondWith(handlePlacesRequest(event.request))
+    }
     else {
         // Helper function to strip query parameters from a URL
         function stripQuery(url) {
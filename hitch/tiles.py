@@ -0,0 +1,162 @@
+import contextlib
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+import simplejson
+
+from hitch.dist import ENCODINGS, HASH_SUFFIX, write_dist_file
+from hitch.helpers import get_dirs
+from hitch.spatial import CLUSTER_MAX_ZOOM, CLUSTER_RADIUS, cell_keys
+
+# Tiles are written to dist/tiles/<z>/<x>/<y>.json. Below CLUSTER_MAX_ZOOM they hold clusters, at CLUSTER_MAX_ZOOM
+# the places themselves, which the client also uses for all higher zoom levels.
+TILES_DIR = "tiles"
+
+# The hash of every tile written, by the dist directory it was written to, so unchanged and empty tiles are found
+# without reading the whole tile tree. Deleting it makes the next run scan the tiles on disk once.
+MANIFEST_PATH = os.path.join(get_dirs()["db"], "tiles.sqlite")
+
+# Web Mercator does not reach the poles
+MAX_LAT = 85.0511287798
+
+
+def tile_coords(lat, lon, zoom):
+    """Returns the x and y of the tile every coordinate falls into"""
+    n = 2**zoom
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    x = np.floor((lon + 180) / 360 * n)
+    y = np.floor((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def cluster(lat, lon, rating, wait, zoom):
+    """Groups places the way `hitch.spatial.PlaceIndex.lookup` does for the zoom level
+
+    Returns:
+        Centroid, number of places, mean rating and mean wait (NaN without any) of every cluster
+    """
+    cell_size = 360 * CLUSTER_RADIUS / (256 * 2**zoom)
+    _, inverse, counts = np.unique(cell_keys(lat, lon, cell_size), return_inverse=True, return_counts=True)
+
+    has_wait = ~np.isnan(wait)
+    wait_counts = np.bincount(inverse[has_wait], minlength=len(counts))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_wait = np.bincount(inverse[has_wait], weights=wait[has_wait], minlength=len(counts)) / wait_counts
+
+    return (
+        np.bincount(inverse, weights=lat) / counts,
+        np.bincount(inverse, weights=lon) / counts,
+        counts,
+        np.bincount(inverse, weights=rating) / counts,
+        mean_wait,
+    )
+
+
+def build_tiles(places):
+    """Returns the content of every non-empty tile by its path below the tiles directory
+
+    Args:
+        places: The places as returned by `hitch.scripts.show.build_places`, indexed by (lat, lon)
+    """
+    places = places.sort_index()
+    lat = places.index.get_level_values("lat").to_numpy(dtype=float)
+    lon = places.index.get_level_values("lon").to_numpy(dtype=float)
+    rating, wait = places.rating.to_numpy(dtype=float), places.wait.to_numpy(dtype=float)
+
+    tiles = {}
+    for zoom in range(CLUSTER_MAX_ZOOM):
+        c_lat, c_lon, counts, c_rating, c_wait = cluster(lat, lon, rating, wait, zoom)
+        xs, ys = tile_coords(c_lat, c_lon, zoom)
+        rows = zip(xs, ys, np.round(c_lat, 5), np.round(c_lon, 5), counts, np.round(c_rating, 1), np.round(c_wait), strict=True)
+
+        clusters = {}
+        for x, y, c_lat, c_lon, count, c_rating, c_wait in rows:
+            row = [float(c_lat), float(c_lon), int(count), float(c_rating), float(c_wait)]
+            clusters.setdefault(f"{zoom}/{x}/{y}.json", []).append(row)
+        for path, rows in clusters.items():
+            tiles[path] = simplejson.dumps({"clusters": rows}, ignore_nan=True)
+
+    # The records are already serialized, so they are only joined
+    xs, ys = tile_coords(lat, lon, CLUSTER_MAX_ZOOM)
+    paths = [f"{CLUSTER_MAX_ZOOM}/{x}/{y}.json" for x, y in zip(xs, ys, strict=True)]
+    grouped = {}
+    for path, place_id, record in zip(paths, places.id, places.json, strict=True):
+        grouped.setdefault(path, ([], []))
+        grouped[path][0].append(str(place_id))
+        grouped[path][1].append(record)
+    for path, (ids, records) in grouped.items():
+        tiles[path] = f'{{"ids": [{", ".join(ids)}], "places": [{", ".join(records)}]}}'
+
+    return tiles
+
+
+def scan_tiles(root):
+    """Returns the hash of every tile on disk by its path below the tiles directory"""
+    hashes = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            filepath = os.path.join(directory, filename)
+            if filename.endswith(".json" + HASH_SUFFIX):
+                with open(filepath, encoding="utf-8") as f:
+                    hashes[os.path.relpath(filepath, root).removesuffix(HASH_SUFFIX)] = f.read().strip()
+    return hashes
+
+
+def remove_tile(filepath):
+    """Removes a tile with its hash and its precompressed siblings"""
+    for suffix in ["", HASH_SUFFIX, *ENCODINGS.values()]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(filepath + suffix)
+
+
+def write_tiles(places, manifest_path=MANIFEST_PATH):
+    """Writes the tiles of the places, leaving those whose content did not change untouched and removing empty ones
+
+    Tiles are compared with the hashes of the manifest, the tile tree is only read if there is none for this dist
+    directory yet.
+
+    Returns:
+        The number of tiles written
+    """
+    dist = get_dirs()["dist"]
+    root = os.path.join(dist, TILES_DIR)
+    tiles = build_tiles(places)
+
+    con = sqlite3.connect(manifest_path)
+    try:
+        con.execute("create table if not exists tiles (root text, path text, hash text, primary key (root, path))")
+        old = dict(con.execute("select path, hash from tiles where root = ?", (dist,)))
+        # No manifest yet, or the tiles were deleted since
+        scanned = not old or not os.path.isdir(root)
+        if scanned:
+            old = scan_tiles(root)
+
+        hashes, written = {}, 0
+        for path, content in tiles.items():
+            data = content.encode("utf-8")
+            hashes[path] = hashlib.sha256(data).hexdigest()
+            if old.get(path) == hashes[path]:
+                continue
+
+            os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+            write_dist_file(data, os.path.join(TILES_DIR, path))
+            written += 1
+
+        removed = old.keys() - tiles.keys()
+        for path in removed:
+            remove_tile(os.path.join(root, path))
+
+        with con:
+            if scanned:
+                con.execute("delete from tiles where root = ?", (dist,))
+            con.executemany("delete from tiles where root = ? and path = ?", [(dist, path) for path in removed])
+            con.executemany(
+                "insert or replace into tiles values (?, ?, ?)",
+                [(dist, path, digest) for path, digest in hashes.items() if scanned or old.get(path) != digest],
+            )
+    finally:
+        con.close()
+
+    return written
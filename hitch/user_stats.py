@@ -0,0 +1,222 @@
+import json
+import math
+import sqlite3
+import time
+
+# Totals of the reviews of every registered user, kept up to date by `hitch.writer.Writer.insert_point` and rebuilt by
+# the user_stats script. Only sums and counts are stored, so every review can be added without reading the others.
+CREATE_USER_STATS = """
+create table if not exists user_stats (
+    user_id INTEGER PRIMARY KEY,
+    reviews INTEGER NOT NULL,
+    waits INTEGER NOT NULL,
+    wait_sum REAL NOT NULL,
+    rides INTEGER NOT NULL,
+    distance_sum REAL NOT NULL,
+    countries TEXT NOT NULL,
+    first_review TEXT,
+    last_review TEXT
+)
+"""
+
+USER_STATS_COLUMNS = [
+    "user_id",
+    "reviews",
+    "waits",
+    "wait_sum",
+    "rides",
+    "distance_sum",
+    "countries",
+    "first_review",
+    "last_review",
+]
+
+# Adds one review, countries is a JSON object of the number of reviews per country code
+ADD_REVIEW = """
+insert into user_stats values (
+    :user_id, 1, :wait is not null, coalesce(:wait, 0), :distance is not null, coalesce(:distance, 0),
+    case when :country is null then '{}' else json_object(:country, 1) end, :datetime, :datetime
+)
+on conflict (user_id) do update set
+    reviews = reviews + 1,
+    waits = waits + excluded.waits,
+    wait_sum = wait_sum + excluded.wait_sum,
+    rides = rides + excluded.rides,
+    distance_sum = distance_sum + excluded.distance_sum,
+    countries = case
+        when :country is null then countries
+        else json_set(
+            countries, '$.' || json_quote(:country), coalesce(json_extract(countries, '$.' || json_quote(:country)), 0) + 1
+        )
+    end,
+    first_review = coalesce(min(first_review, excluded.first_review), first_review, excluded.first_review),
+    last_review = coalesce(max(last_review, excluded.last_review), last_review, excluded.last_review)
+"""
+
+# Seconds an account page uses the same stats, so a burst of views reads the table once
+CACHE_TTL = 60
+CACHE_SIZE = 1024
+
+cache = {}
+
+
+def get_distance(lat, lon, dest_lat, dest_lon):
+    """Returns the ride distance the same way `hitch.geo.haversine_np` does, or None without a destination
+
+    Rides shorter than 1 km are not counted, the map shows no destination for them either.
+    """
+    if any(v is None or math.isnan(v) for v in [lat, lon, dest_lat, dest_lon]):
+        return None
+    lat, lon, dest_lat, dest_lon = map(math.radians, [lat, lon, dest_lat, dest_lon])
+    a = math.sin((dest_lat - lat) / 2) ** 2 + math.cos(lat) * math.cos(dest_lat) * math.sin((dest_lon - lon) / 2) ** 2
+    km = 1.25 * 6367 * 2 * math.asin(math.sqrt(a))
+    return km if km >= 1 else None
+
+
+def get_review_params(row):
+    """Returns the parameters of `ADD_REVIEW` for a review as stored by `hitch.writer.Writer.insert_point`"""
+    return {
+        "user_id": row["user_id"],
+        "wait": row["wait"],
+        "distance": get_distance(row["lat"], row["lon"], row["dest_lat"], row["dest_lon"]),
+        "country": row["country"],
+        "datetime": row["datetime"],
+    }
+
+
+def get_review_counts(points, users):
+    """Returns the number of reviews of every registered user
+
+    Reviews are attributed by hitchhiker name (the nickname of old reviews, otherwise the username of the author)
+    compared case-insensitively, the same way the user filter of the map matches them.
+
+    Args:
+        points: Reviews with at least the nickname and user_id columns
+        users: Users with the id and username columns
+
+    Returns:
+        A DataFrame with the columns id, username and reviews, in the order of `users`
+    """
+    usernames = users.set_index("id").username
+    hitchhikers = points.nickname.fillna(points.user_id.map(usernames))
+    counts = hitchhikers.str.lower().value_counts()
+
+    users = users[["id", "username"]].copy()
+    users["reviews"] = users.username.str.lower().map(counts).fillna(0).astype(int)
+    return users
+
+
+def compute_user_stats(points, users):
+    """Returns the rows of the user_stats table for the reviews, attributed the same way as in `get_review_counts`
+
+    Args:
+        points: Reviews with at least the nickname, user_id, wait, country, datetime, lat, lon, dest_lat and dest_lon
+            columns
+        users: Users with the id and username columns
+
+    Returns:
+        A DataFrame with the columns of the table, for the users with at least one review
+    """
+    # numpy is only loaded by the generators
+    from hitch.geo import haversine_np
+
+    usernames = users.set_index("id").username
+    user_ids = users.drop_duplicates("username").set_index(users.username.str.lower()).id
+    hitchhikers = points.nickname.fillna(points.user_id.map(usernames)).str.lower()
+
+    points = points.assign(user_id=hitchhikers.map(user_ids)).dropna(subset=["user_id"])
+    distance = haversine_np(points.lon, points.lat, points.dest_lon, points.dest_lat)
+    points = points.assign(distance=distance.where(distance >= 1), datetime=points.datetime.astype("string"))
+
+    groups = points.groupby("user_id")
+    stats = groups.agg(
+        reviews=("user_id", "size"),
+        waits=("wait", "count"),
+        wait_sum=("wait", "sum"),
+        rides=("distance", "count"),
+        distance_sum=("distance", "sum"),
+        first_review=("datetime", "min"),
+        last_review=("datetime", "max"),
+    )
+    countries = points.dropna(subset=["country"]).groupby("user_id").country.value_counts()
+    stats["countries"] = [
+        json.dumps(countries[user_id].to_dict() if user_id in countries.index else {}, separators=(",", ":"))
+        for user_id in stats.index
+    ]
+    return stats.reset_index()[USER_STATS_COLUMNS].astype({"user_id": int})
+
+
+def write_user_stats(con, stats, watermark):
+    """Replaces the contents of the user_stats table with the rows of `compute_user_stats`
+
+    Reviews submitted while the stats were computed were already added to the old table, so they are added again to the
+    new one, in the same transaction that blocks further reviews.
+
+    Args:
+        con: Connection to the database
+        stats: The stats as returned by `compute_user_stats`
+        watermark: The highest rowid of the reviews the stats were computed from
+
+    Returns:
+        The number of reviews added again
+    """
+    with con:
+        con.execute("begin immediate")
+        con.execute(CREATE_USER_STATS)
+        con.execute("delete from user_stats")
+        con.executemany(
+            f"insert into user_stats values ({', '.join('?' * len(USER_STATS_COLUMNS))})",
+            stats.astype(object).where(stats.notna(), None).itertuples(index=False, name=None),
+        )
+
+        cursor = con.execute(
+            "select user_id, wait, lat, lon, dest_lat, dest_lon, country, datetime from points"
+            " where rowid > ? and user_id is not null and banned = 0 order by rowid",
+            (watermark,),
+        )
+        new = [dict(zip([c[0] for c in cursor.description], row, strict=True)) for row in cursor]
+        con.executemany(ADD_REVIEW, [get_review_params(row) for row in new])
+    return len(new)
+
+
+def get_user_stats(con, user_id):
+    """Returns the stats shown on the account page of a user, or None without any reviews
+
+    Read with one lookup by primary key, and cached for `CACHE_TTL` seconds.
+    """
+    now = time.monotonic()
+    cached = cache.get(user_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    try:
+        row = con.execute(f"select {', '.join(USER_STATS_COLUMNS)} from user_stats where user_id = ?", (user_id,)).fetchone()
+    except sqlite3.OperationalError:  # The table does not exist before the first review or run of the user_stats script
+        row = None
+
+    stats = None
+    if row is not None:
+        row = dict(zip(USER_STATS_COLUMNS, row, strict=True))
+        countries = json.loads(row["countries"])
+        stats = {
+            "reviews": row["reviews"],
+            "average_wait": row["wait_sum"] / row["waits"] if row["waits"] else None,
+            "rides": row["rides"],
+            "distance": row["distance_sum"],
+            "countries": sorted(countries, key=lambda c: (-countries[c], c)),
+            "first_review": row["first_review"],
+            "last_review": row["last_review"],
+        }
+
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+    cache[user_id] = (now + CACHE_TTL, stats)
+    return stats
+
+
+def clear_cached_stats(user_id):
+    """Drops the cached stats of a user, so the account page shows a review right after it is stored
+
+    Only the cache of this process is cleared, other processes show the review once their entry expires.
+    """
+    cache.pop(user_id, None)
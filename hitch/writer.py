@@ -0,0 +1,248 @@
+import logging
+import math
+import queue
+import threading
+from concurrent.futures import Future
+
+from hitch.helpers import connect_db, get_db
+from hitch.user_stats import ADD_REVIEW, CREATE_USER_STATS, clear_cached_stats, get_review_params
+
+logger = logging.getLogger(__name__)
+
+POINT_COLUMNS = [
+    "id",
+    "rating",
+    "wait",
+    "comment",
+    "nickname",
+    "datetime",
+    "ip",
+    "reviewed",
+    "banned",
+    "lat",
+    "dest_lat",
+    "lon",
+    "dest_lon",
+    "country",
+    "signal",
+    "ride_datetime",
+    "user_id",
+]
+
+DUPLICATE_COLUMNS = [
+    "datetime",
+    "ip",
+    "reviewed",
+    "accepted",
+    "from_lat",
+    "to_lat",
+    "from_lon",
+    "to_lon",
+]
+
+# Same column types as pandas used to create when the first row was appended
+CREATE_POINTS = """
+create table if not exists points (
+    id INTEGER,
+    rating REAL,
+    wait REAL,
+    comment TEXT,
+    nickname TEXT,
+    datetime TEXT,
+    ip TEXT,
+    reviewed INTEGER,
+    banned INTEGER,
+    lat REAL,
+    dest_lat REAL,
+    lon REAL,
+    dest_lon REAL,
+    country TEXT,
+    signal TEXT,
+    ride_datetime TEXT,
+    user_id INTEGER
+)
+"""
+
+CREATE_DUPLICATES = """
+create table if not exists duplicates (
+    id INTEGER PRIMARY KEY,
+    datetime TEXT,
+    ip TEXT,
+    reviewed INTEGER,
+    accepted INTEGER,
+    from_lat REAL,
+    to_lat REAL,
+    from_lon REAL,
+    to_lon REAL
+)
+"""
+
+# Indexes of the queries run on every request or generator run, see `flask benchmark-queries` for their plans
+CREATE_INDEXES = [
+    # Reviews that are not banned by datetime, e.g. the recent feed
+    "create index if not exists points_banned_datetime on points (banned, datetime)",
+    # All reviews of a spot, e.g. incremental runs of show
+    "create index if not exists points_lat_lon on points (lat, lon)",
+    # Reviews of a user, e.g. their account page, old reviews only have a nickname
+    "create index if not exists points_user_id on points (user_id)",
+    "create index if not exists points_nickname on points (nickname collate nocase)",
+    # Reviews in a country, e.g. filtered by /api/points
+    "create index if not exists points_country on points (country)",
+    # Duplicate reports by state
+    "create index if not exists duplicates_reviewed_accepted on duplicates (reviewed, accepted)",
+]
+
+# The statements are constant, so sqlite3 prepares them once per connection and reuses them from its statement cache
+INSERT_POINT = f"insert into points ({', '.join(POINT_COLUMNS)}) values ({', '.join(':' + c for c in POINT_COLUMNS)})"
+INSERT_DUPLICATE = (
+    f"insert into duplicates ({', '.join(DUPLICATE_COLUMNS)}) values ({', '.join(':' + c for c in DUPLICATE_COLUMNS)})"
+)
+
+
+def get_index_name(statement):
+    return statement.split(" if not exists ")[1].split()[0]
+
+
+def create_indexes(con):
+    """Creates the indexes missing from the database, e.g. one that was created by pandas or restored from a dump
+
+    Returns:
+        The names of the indexes that were created
+    """
+    existing = {name for (name,) in con.execute("select name from sqlite_master where type = 'index'")}
+    created = []
+    with con:
+        for statement in CREATE_INDEXES:
+            if get_index_name(statement) not in existing:
+                con.execute(statement)
+                created.append(get_index_name(statement))
+    return created
+
+
+def clean(row, columns):
+    """Returns the values of the given columns, NaN is stored as NULL the same way pandas did"""
+    return {c: None if isinstance(row.get(c), float) and math.isnan(row[c]) else row.get(c) for c in columns}
+
+
+class GroupCommitQueue:
+    """Executes writes from all request threads on one connection, committing bursts of them in a single transaction
+
+    The first write of a batch waits for `delay` seconds to collect more writes. Callers block until their write is
+    committed, so a redirect after a submission still shows the stored data. A write is a list of (sql, params)
+    statements that are committed together.
+    """
+
+    def __init__(self, database, delay, busy_timeout):
+        self.database = database
+        self.delay = delay
+        self.busy_timeout = busy_timeout
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="group-commit", daemon=True)
+        self.thread.start()
+
+    def submit(self, statements):
+        future = Future()
+        self.queue.put((statements, future))
+        return future
+
+    def run(self):
+        con = connect_db(self.database, self.busy_timeout)
+
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while True:
+                    batch.append(self.queue.get(timeout=self.delay))
+            except queue.Empty:
+                pass
+
+            try:
+                with con:
+                    for statements, _ in batch:
+                        for sql, params in statements:
+                            con.execute(sql, params)
+            except Exception:
+                logger.exception(f"Group commit of {len(batch)} writes failed, retrying them one by one")
+                for statements, future in batch:
+                    try:
+                        with con:
+                            for sql, params in statements:
+                                con.execute(sql, params)
+                    except Exception as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(None)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+
+class Writer:
+    """Write path for reviews and duplicate reports
+
+    Writes go through the request's connection and are committed right away, or through a `GroupCommitQueue` if
+    WRITE_GROUP_COMMIT is enabled.
+    """
+
+    def __init__(self, app=None):
+        self.group_commit = None
+        self.lock = threading.Lock()
+        # The user_stats table is created with the first review of every process, databases may predate it
+        self.has_user_stats = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+        app.extensions["writer"] = self
+
+    def create_tables(self):
+        """Creates the tables written to and their indexes, for fresh installations without a database dump
+
+        Existing databases only get the indexes they are missing.
+        """
+        con = get_db()
+        with con:
+            con.execute(CREATE_POINTS)
+            con.execute(CREATE_DUPLICATES)
+            con.execute(CREATE_USER_STATS)
+        create_indexes(con)
+
+    def get_queue(self):
+        with self.lock:
+            if self.group_commit is None:
+                self.group_commit = GroupCommitQueue(
+                    self.config["DATABASE_URI"], self.config["WRITE_GROUP_COMMIT_DELAY"], self.config["DATABASE_BUSY_TIMEOUT"]
+                )
+            return self.group_commit
+
+    def execute(self, *statements):
+        """Executes and commits the (sql, params) statements in one transaction"""
+        if self.config["WRITE_GROUP_COMMIT"]:
+            self.get_queue().submit(statements).result()
+        else:
+            con = get_db()
+            with con:
+                for sql, params in statements:
+                    con.execute(sql, params)
+
+    def insert_point(self, row):
+        """Stores a review, columns missing from `row` are stored as NULL
+
+        Reviews of registered users are added to their stats in the same transaction.
+        """
+        row = clean(row, POINT_COLUMNS)
+        statements = [(INSERT_POINT, row)]
+        if row["user_id"] is None:
+            return self.execute(*statements)
+
+        if not self.has_user_stats:
+            statements.append((CREATE_USER_STATS, ()))
+        statements.append((ADD_REVIEW, get_review_params(row)))
+        self.execute(*statements)
+        self.has_user_stats = True
+        clear_cached_stats(row["user_id"])
+
+    def insert_duplicate(self, row):
+        """Stores a duplicate report, columns missing from `row` are stored as NULL"""
+        self.execute((INSERT_DUPLICATE, clean(row, DUPLICATE_COLUMNS)))
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from hitch.scripts.heatmap import get_cells
+from hitch.tiles import MAX_LAT
+
+
+def test_get_cells_clamps_polar_points():
+    lat = np.array([-90.0, 10.0, 20.0, 30.0, 40.0])
+    lon = np.array([0.0, 10.0, 20.0, 30.0, 40.0])
+
+    cells, bounds = get_cells(lat, lon, 10)
+
+    # Projected onto the edge of Web Mercator, the pole does not push all other points into the first row
+    rows = cells // 10
+    assert rows[0] == 0
+    assert rows[-1] == 9
+    assert (np.diff(rows) >= 0).all() and rows[1] > 0
+    assert (cells == get_cells(np.array([-MAX_LAT, 10.0, 20.0, 30.0, 40.0]), lon, 10)[0]).all()
+
+    assert np.isfinite(bounds).all()
+    assert bounds[0][0] == pytest.approx(-MAX_LAT)
+    assert bounds[1][0] == pytest.approx(40.0)
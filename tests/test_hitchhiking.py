@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+
+from hitch.scripts import hitchhiking
+
+
+def make_rasters(value):
+    return {name: np.full((2, 3), value) for name in hitchhiking.RASTERS}
+
+
+def test_save_rasters_replaces_an_existing_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(hitchhiking, "RASTER_CACHE", str(tmp_path))
+
+    hitchhiking.save_rasters("key", make_rasters(1.0))
+    # e.g. --args refresh, or another run with the same key
+    hitchhiking.save_rasters("key", make_rasters(2.0))
+
+    rasters = hitchhiking.load_rasters("key")
+    assert (rasters["raw_raster"] == 2.0).all()
+    assert os.listdir(tmp_path) == ["key"]
+
+
+def test_save_rasters_removes_other_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr(hitchhiking, "RASTER_CACHE", str(tmp_path))
+
+    hitchhiking.save_rasters("old", make_rasters(1.0))
+    hitchhiking.save_rasters("new", make_rasters(2.0))
+
+    assert os.listdir(tmp_path) == ["new"]
+    assert hitchhiking.load_rasters("old") is None
+    assert (hitchhiking.load_rasters()["raw_raster"] == 2.0).all()
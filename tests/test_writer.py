@@ -0,0 +1,21 @@
+from flask import Flask
+
+from hitch import user_stats
+from hitch.helpers import close_db, get_db
+from hitch.writer import Writer
+
+
+def test_insert_point_clears_the_cached_stats_of_the_user(tmp_path, monkeypatch):
+    monkeypatch.setattr(user_stats, "cache", {})
+    app = Flask(__name__)
+    app.config.update(DATABASE_URI=str(tmp_path / "points.sqlite"), DATABASE_BUSY_TIMEOUT=1000, WRITE_GROUP_COMMIT=False)
+    app.teardown_appcontext(close_db)
+    writer = Writer(app)
+
+    with app.app_context():
+        writer.create_tables()
+        writer.insert_point({"lat": 50.0, "lon": 10.0, "user_id": 1, "wait": 10, "datetime": "2024-01-01 12:00:00"})
+        assert user_stats.get_user_stats(get_db(), 1)["reviews"] == 1
+
+        writer.insert_point({"lat": 51.0, "lon": 11.0, "user_id": 1, "wait": 20, "datetime": "2024-01-02 12:00:00"})
+        assert user_stats.get_user_stats(get_db(), 1)["reviews"] == 2